@@ -0,0 +1,234 @@
+"""timing comparisons for the edhec_risk_kit hot paths
+run from this folder: python benchmarks.py [small|medium|large ...], or python benchmarks.py cppi for bench_cppi
+every case runs on synthetic inputs, no course csv files needed, and each run is appended to HISTORY_FILE
+profile_calls records per-call timings of the kit functions inside a real workflow"""
+import os
+import sys
+import json
+import time
+import platform
+import warnings
+import tempfile
+import tracemalloc
+import functools
+import contextlib
+import subprocess
+import numpy as np
+import pandas as pd
+import edhec_risk_kit as erk
+
+HISTORY_FILE='benchmark_history.jsonl'
+
+SIZES={
+    'small':{'n_scenarios':1000,'n_years':10,'n_assets':10,'n_months':240},
+    'medium':{'n_scenarios':10000,'n_years':30,'n_assets':30,'n_months':600},
+    'large':{'n_scenarios':100000,'n_years':30,'n_assets':100,'n_months':1200},
+}
+
+def timeit(func,*args,repeat=3,**kwargs):
+    """best wall time in seconds of func(*args, **kwargs) over repeat runs"""
+    best=np.inf
+    for _ in range(repeat):
+        start=time.perf_counter()
+        func(*args,**kwargs)
+        best=min(best,time.perf_counter()-start)
+    return best
+
+def measure(func,*args,repeat=3,**kwargs):
+    """best wall time over repeat runs, then one run under tracemalloc for the peak traced memory
+    and the number of memory blocks still allocated by the call (its result included)"""
+    wall=timeit(func,*args,repeat=repeat,**kwargs)
+    tracemalloc.start()
+    try:
+        before=tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result=func(*args,**kwargs)
+        _,peak=tracemalloc.get_traced_memory()
+        after=tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks=sum(stat.count_diff for stat in after.compare_to(before,'filename') if stat.count_diff>0)
+    del result
+    return {'wall_s':wall,'peak_mb':peak/2**20,'new_blocks':blocks}
+
+def bench_cppi(sizes=(1000,10000,100000),n_years=30,steps_per_year=12,max_loop_scenarios=10000):
+    """compare the step-by-step run_cppi0 with the vectorized run_cppi on monthly GBM scenarios
+    run_cppi0 is skipped above max_loop_scenarios, it takes minutes there"""
+    rows=[]
+    for n_scenarios in sizes:
+        risky_r=pd.DataFrame(erk.gbm(n_years,n_scenarios,steps_per_year=steps_per_year,prices=False))
+        t_vec=timeit(erk.run_cppi,risky_r)
+        t_loop=timeit(erk.run_cppi0,risky_r,repeat=1) if n_scenarios<=max_loop_scenarios else np.nan
+        rows.append({'scenarios':n_scenarios,'run_cppi0 (s)':t_loop,'run_cppi (s)':t_vec,'speedup':t_loop/t_vec})
+    return pd.DataFrame(rows).set_index('scenarios')
+
+## synthetic inputs
+def synthetic_returns(n_months,n_assets,seed=0):
+    """monthly returns with a PeriodIndex, as the kit's loaders return them"""
+    rng=np.random.default_rng(seed)
+    index=pd.period_range('1926-07',periods=n_months,freq='M')
+    return pd.DataFrame(rng.normal(0.008,0.05,size=(n_months,n_assets)),index=index,
+                        columns=['A{}'.format(i) for i in range(n_assets)])
+
+def synthetic_er_cov(n_assets,seed=0):
+    """annualized expected returns and a positive definite covariance matrix"""
+    r=synthetic_returns(120,n_assets,seed)
+    return erk.annualized_rets(r,12),r.cov()*12
+
+def write_ind_files(directory,n_months,n_industries=30,seed=0):
+    """write the three ind30 csv files the industry loaders parse, in the Fama French YYYYMM layout"""
+    rng=np.random.default_rng(seed)
+    index=pd.Index(pd.period_range('1926-07',periods=n_months,freq='M').strftime('%Y%m'))
+    columns=['Ind{:<5}'.format(i) for i in range(n_industries)]
+    files={'ind30_m_vw_rets.csv':rng.normal(0.8,5,size=(n_months,n_industries)),
+           'ind30_m_size.csv':rng.lognormal(6,1,size=(n_months,n_industries)),
+           'ind30_m_nfirms.csv':rng.integers(10,500,size=(n_months,n_industries))}
+    for name,values in files.items():
+        pd.DataFrame(values,index=index,columns=columns).to_csv(os.path.join(directory,name))
+
+@contextlib.contextmanager
+def working_dir(directory):
+    cwd=os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+def in_dir(directory,func):
+    """func run from directory, the loaders read and cache relative to the working directory"""
+    def run(*args,**kwargs):
+        with working_dir(directory):
+            return func(*args,**kwargs)
+    return run
+
+def cold_total_market_return():
+    """csv parse and cache write, nothing cached in process or on disk"""
+    erk.load_dataset.cache_clear()
+    if os.path.isdir(erk.CACHE_DIR):
+        for name in os.listdir(erk.CACHE_DIR):
+            os.remove(os.path.join(erk.CACHE_DIR,name))
+    return erk.get_total_market_return()
+
+def warm_total_market_return():
+    """memory-map from the disk cache, nothing cached in process"""
+    erk.load_dataset.cache_clear()
+    return erk.get_total_market_return()
+
+## cases, each maps a size dict and a scratch directory to (func, args, kwargs) with the inputs already built
+def case_gbm(size,scratch):
+    return erk.gbm,(size['n_years'],size['n_scenarios']),{'prices':False}
+
+def case_run_cppi(size,scratch):
+    np.random.seed(0)
+    risky_r=pd.DataFrame(erk.gbm(size['n_years'],size['n_scenarios'],prices=False)[1:])
+    return erk.run_cppi,(risky_r,),{}
+
+def case_cir(size,scratch):
+    return erk.cir,(size['n_years'],size['n_scenarios']),{}
+
+def case_bond_price(size,scratch):
+    np.random.seed(0)
+    rates,_=erk.cir(size['n_years'],size['n_scenarios'])
+    return erk.bond_price,(size['n_years'],100,0.05,12,rates),{}
+
+def case_optiminal_weights(size,scratch):
+    er,cov=synthetic_er_cov(size['n_assets'])
+    return erk.optiminal_weights,(25,er,cov),{}
+
+def case_summary_stats(size,scratch):
+    return erk.summary_stats,(synthetic_returns(size['n_months'],size['n_assets']),),{}
+
+def case_loader(func):
+    def setup(size,scratch):
+        directory=tempfile.mkdtemp(dir=scratch)
+        write_ind_files(directory,size['n_months'])
+        if func is warm_total_market_return:
+            in_dir(directory,cold_total_market_return)()
+        return in_dir(directory,func),(),{}
+    return setup
+
+CASES={
+    'gbm':case_gbm,
+    'run_cppi':case_run_cppi,
+    'cir':case_cir,
+    'bond_price':case_bond_price,
+    'optiminal_weights':case_optiminal_weights,
+    'summary_stats':case_summary_stats,
+    'read_ind_returns':case_loader(erk.read_ind_returns),
+    'get_total_market_return cold':case_loader(cold_total_market_return),
+    'get_total_market_return warm':case_loader(warm_total_market_return),
+}
+
+def git_commit():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes=('small','medium'),cases=None,repeat=3,history=HISTORY_FILE):
+    """measure every case at every size and append one json line per measurement to history (None to skip)
+    returns the measurements as a dataframe"""
+    cases=list(CASES) if cases is None else cases
+    context={'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),'commit':git_commit(),
+             'python':platform.python_version(),'numpy':np.__version__,'pandas':pd.__version__,
+             'machine':platform.machine(),'cpus':os.cpu_count()}
+    rows=[]
+    with tempfile.TemporaryDirectory(prefix='erk_bench_') as scratch, warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for size_name in sizes:
+            size=SIZES[size_name]
+            for case in cases:
+                func,args,kwargs=CASES[case](size,scratch)
+                row=dict(context,case=case,size=size_name,**size)
+                row.update(measure(func,*args,repeat=repeat,**kwargs))
+                rows.append(row)
+                if history is not None:
+                    with open(history,'a') as f:
+                        f.write(json.dumps(row)+'\n')
+    return pd.DataFrame(rows)
+
+def load_history(history=HISTORY_FILE):
+    """all recorded measurements, one row per case, size and run"""
+    return pd.read_json(history,lines=True)
+
+## opt-in profiling of real workflows
+@contextlib.contextmanager
+def profile_calls(module=erk,names=None):
+    """record the wall time of every call of module's functions made inside the with block
+    yields a dict of function name -> list of call durations in seconds, see call_summary
+    calls between kit functions go through the module globals, so inner calls are recorded too (times are inclusive)"""
+    if names is None:
+        names=[name for name,obj in vars(module).items()
+               if callable(obj) and getattr(obj,'__module__',None)==module.__name__ and not isinstance(obj,type)]
+    calls={name:[] for name in names}
+    originals={name:getattr(module,name) for name in names}
+    def timed(name,func):
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            start=time.perf_counter()
+            try:
+                return func(*args,**kwargs)
+            finally:
+                calls[name].append(time.perf_counter()-start)
+        return wrapper
+    for name,func in originals.items():
+        setattr(module,name,timed(name,func))
+    try:
+        yield calls
+    finally:
+        for name,func in originals.items():
+            setattr(module,name,func)
+
+def call_summary(calls):
+    """calls, total, mean and max seconds per called function, slowest total first"""
+    rows={name:{'calls':len(t),'total_s':sum(t),'mean_s':np.mean(t),'max_s':max(t)} for name,t in calls.items() if t}
+    return pd.DataFrame.from_dict(rows,orient='index').sort_values('total_s',ascending=False)
+
+if __name__=='__main__':
+    if sys.argv[1:]==['cppi']:
+        print(bench_cppi())
+    else:
+        result=run_benchmarks(sys.argv[1:] or ('small',))
+        print(result.set_index(['case','size'])[['wall_s','peak_mb','new_blocks']])
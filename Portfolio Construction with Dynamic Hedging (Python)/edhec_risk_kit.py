@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 def drawdown(returns_series:pd.Series):
   
     """take a time series of asset returns
@@ -16,8 +17,72 @@ def drawdown(returns_series:pd.Series):
         'Drawdown':drawdowns 
     })
     
-def get_ffme_returns():
-    """load the Farma French dataset for the returns of top and bottom deciles by MarketCap"""
+import os
+import json
+import functools
+CACHE_DIR='.erk_cache'
+
+def source_key(sources):
+    """(path, mtime, size) of every source file, touching any of them invalidates the cached dataset"""
+    stats=[os.stat(path) for path in sources]
+    return tuple((path,st.st_mtime_ns,st.st_size) for path,st in zip(sources,stats))
+
+def cached_dataset(name,sources,build,copy=False):
+    """return the dataset built by build() from the csv files in sources
+    the first build is written to CACHE_DIR as .npy files keyed on the sources' mtime and size,
+    later sessions memory-map it back without parsing, and an in-process LRU skips the disk on repeated calls
+    the values are a read-only memory map in every session, also right after the build, so writing into them
+    raises ValueError instead of reaching the cache; index and column changes stay local to the returned object
+    copy=True returns a private writable copy instead"""
+    data=load_dataset(name,source_key(sources),build)
+    return data.copy(deep=copy)
+
+@functools.lru_cache(maxsize=32)
+def load_dataset(name,key,build):
+    """map the cached dataset if it is up to date, otherwise build it and write it to the cache"""
+    base=os.path.join(CACHE_DIR,name)
+    key=json.loads(json.dumps(key)) # tuples come back from json as lists
+    try:
+        with open(base+'.json') as f:
+            meta=json.load(f)
+    except (OSError,ValueError):
+        meta=None
+    if meta is None or meta['key']!=key:
+        meta=write_dataset(base,key,build())
+    # the fresh build is mapped back too, so this session sees the same read-only data as the later ones
+    values=np.load(base+'.values.npy',mmap_mode='r')
+    index=np.load(base+'.index.npy',mmap_mode='r')
+    if meta['freq'] is not None:
+        index=pd.PeriodIndex(pd.arrays.PeriodArray(np.asarray(index),dtype=pd.PeriodDtype(meta['freq'])))
+    if meta['series']:
+        return pd.Series(values[:,0],index=index,name=meta['name'],copy=False)
+    return pd.DataFrame(values,index=index,columns=meta['columns'],copy=False)
+
+def write_dataset(base,key,data):
+    """save data as memory-mappable values and index arrays plus a json header, the header goes last
+    so that a half written cache is never picked up"""
+    os.makedirs(os.path.dirname(base),exist_ok=True)
+    is_series=isinstance(data,pd.Series)
+    frame=data.to_frame() if is_series else data
+    is_period=isinstance(frame.index,pd.PeriodIndex)
+    arrays={'.values.npy':np.ascontiguousarray(frame.values),
+            '.index.npy':frame.index.asi8 if is_period else np.asarray(frame.index)}
+    meta={'key':key,
+          'series':is_series,
+          'name':data.name if is_series else None,
+          'columns':frame.columns.tolist(),
+          'freq':frame.index.freqstr if is_period else None}
+    for suffix,array in arrays.items():
+        with open(base+suffix+'.tmp','wb') as f:
+            np.save(f,array)
+        os.replace(base+suffix+'.tmp',base+suffix)
+    with open(base+'.json.tmp','w') as f:
+        json.dump(meta,f)
+    os.replace(base+'.json.tmp',base+'.json')
+    return meta
+
+def read_ffme_returns():
+    """parse the Farma French csv of the returns of top and bottom deciles by MarketCap"""
     me_m=pd.read_csv('Portfolios_Formed_on_ME_monthly_EW.csv',
                    header=0, index_col=0,na_values=-99.99)
     rets=me_m[['Lo 10','Hi 10']]
@@ -26,43 +91,72 @@ def get_ffme_returns():
     rets.index=pd.to_datetime(rets.index,format='%Y%m').to_period('M')
     return rets
 
-def get_hfi_returns():
-    """load the Farma HF returns"""
+def get_ffme_returns():
+    """load the Farma French dataset for the returns of top and bottom deciles by MarketCap"""
+    return cached_dataset('ffme_returns',['Portfolios_Formed_on_ME_monthly_EW.csv'],read_ffme_returns)
+
+def read_hfi_returns():
+    """parse the Farma HF returns csv"""
     hfi=pd.read_csv('edhec-hedgefundindices.csv',
                    header=0, index_col=0,parse_dates=True)
     hfi=hfi/100
     hfi.index=hfi.index.to_period('M')
     return hfi
 
-def get_ind_returns():
-    """load and format 30 industry portfolios value weighted average monthly returns"""
-    ind=pd.read_csv('ind30_m_vw_rets.csv',header=0,index_col=0,parse_dates=True)/100
+def get_hfi_returns():
+    """load the Farma HF returns"""
+    return cached_dataset('hfi_returns',['edhec-hedgefundindices.csv'],read_hfi_returns)
+
+def read_ind_file(filename):
+    """parse one of the 30 industry portfolios csv files"""
+    ind=pd.read_csv(filename,header=0,index_col=0,parse_dates=True)
     ind.index=pd.to_datetime(ind.index,format='%Y%m').to_period('M')
     ind.columns=ind.columns.str.strip()
     return ind
 
+def read_ind_returns():
+    return read_ind_file('ind30_m_vw_rets.csv')/100
+
+def read_ind_size():
+    return read_ind_file('ind30_m_size.csv')
+
+def read_ind_nfirms():
+    return read_ind_file('ind30_m_nfirms.csv')
+
+def get_ind_returns():
+    """load and format 30 industry portfolios value weighted average monthly returns"""
+    return cached_dataset('ind_returns',['ind30_m_vw_rets.csv'],read_ind_returns)
+
 def get_ind_size():
-    ind=pd.read_csv('ind30_m_size.csv',header=0,index_col=0,parse_dates=True)
-    ind.index=pd.to_datetime(ind.index,format='%Y%m').to_period('M')
-    ind.columns=ind.columns.str.strip()
-    return ind
+    return cached_dataset('ind_size',['ind30_m_size.csv'],read_ind_size)
 
 def get_ind_nfirms():
-    ind=pd.read_csv('ind30_m_nfirms.csv',header=0,index_col=0,parse_dates=True)
-    ind.index=pd.to_datetime(ind.index,format='%Y%m').to_period('M')
-    ind.columns=ind.columns.str.strip()
-    return ind
+    return cached_dataset('ind_nfirms',['ind30_m_nfirms.csv'],read_ind_nfirms)
 
-def get_total_market_return():
-    ind_return=erk.get_ind_returns()
-    ind_size=erk.get_ind_size()
-    ind_nfirms=erk.get_ind_nfirms()
-    ind_mktcap=ind_nfirms*ind_size
+def compute_ind_mktcap():
+    return get_ind_nfirms()*get_ind_size()
+
+def compute_ind_capweight():
+    ind_mktcap=get_ind_market_caps()
     total_mktcap=ind_mktcap.sum(axis='columns')
-    ind_capweight=ind_mktcap.divide(total_mktcap,axis='rows')
-    total_market_return=(ind_capweight*ind_return).sum(axis='columns')
-    return total_market_return
-    
+    return ind_mktcap.divide(total_mktcap,axis='rows')
+
+def compute_total_market_return():
+    return (get_ind_capweights()*get_ind_returns()).sum(axis='columns')
+
+def get_ind_market_caps():
+    """market cap of the 30 industries, number of firms times average size"""
+    return cached_dataset('ind_mktcap',['ind30_m_size.csv','ind30_m_nfirms.csv'],compute_ind_mktcap)
+
+def get_ind_capweights():
+    """cap weights of the 30 industries in the total market"""
+    return cached_dataset('ind_capweight',['ind30_m_size.csv','ind30_m_nfirms.csv'],compute_ind_capweight)
+
+def get_total_market_return():
+    return cached_dataset('total_market_return',
+                          ['ind30_m_vw_rets.csv','ind30_m_size.csv','ind30_m_nfirms.csv'],
+                          compute_total_market_return)
+
 
 def skewness(r):
     demeaned_r=r-r.mean()
@@ -79,6 +173,7 @@ def kurtosis(r):
     return exp/sigma_r**4
 
 import scipy.stats
+import scipy.linalg
 def is_normal(r, level=0.01):
     """apply jarque_bera test to see if a series is normal,
     test is applied 1% by default, return True if series is normally distributed"""
@@ -90,7 +185,6 @@ def semideviation(r):
     is_negative=r<0
     return r[is_negative].std(ddof=0)
 
-import numpy as np
 def var_historic(r,level=5):
     if isinstance(r,pd.DataFrame):
         return r.aggregate(var_historic, level=level)
@@ -136,6 +230,150 @@ def sharpe_ratio(r,riskfree_rate,periods_per_year):
     ann_vol=annualized_vol(r,periods_per_year)
     return ann_ex_ret/ann_vol
 
+def insert_sorted(sorted_r,n,row):
+    """insert one value per column into sorted_r, an N*capacity buffer whose row j holds n[j] sorted values
+    a binary search and one contiguous shift of the values above it per column, NaNs are skipped
+    sorted_r must have room for n[j]+1"""
+    for values,k,x in zip(sorted_r,n,row):
+        if x==x:
+            pos=values[:k].searchsorted(x)
+            values[pos+1:k+1]=values[pos:k]
+            values[pos]=x
+
+def remove_sorted(sorted_r,n,row):
+    """remove one value per column from the first n[j] sorted values of row j of sorted_r, NaNs are skipped"""
+    for values,k,x in zip(sorted_r,n,row):
+        if x==x:
+            pos=values[:k].searchsorted(x)
+            values[pos:k-1]=values[pos+1:k]
+
+class RollingRisk:
+    """risk metrics of every column over a rolling window of the last `window` returns, or an expanding window if window is None
+    moments, semideviation and compounded excess returns are kept as running sums updated in O(1) per observation,
+    historic var/cvar read the quantile off a sorted copy of the window, kept one column per row of a preallocated buffer
+    with a binary search and a shift per observation (the expanding buffer doubles when full),
+    drawdown is measured from the window's peak wealth
+    NaN returns are skipped column by column as pandas does: a rolling window needs `window` valid returns
+    (so a column recovers once the NaN leaves its window), an expanding one 2, and wealth is carried over a NaN
+    observations can be appended at any time (e.g. from a live feed) without recomputing history"""
+    metrics=('annualized vol','sharpe ratio','skewness','kurtosis','semideviation','historic var','historic cvar','drawdown')
+
+    def __init__(self,columns,window=None,periods_per_year=12,riskfree_rate=0.03,level=5):
+        self.columns=pd.Index(columns)
+        n_col=len(self.columns)
+        self.window=window
+        self.periods_per_year=periods_per_year
+        self.rf_per_period=(1+riskfree_rate)**(1/periods_per_year)-1
+        self.level=level
+        self.n_rows=0 # rows currently in the window
+        self.n=np.zeros(n_col,dtype=int) # valid (non NaN) returns per column in the window
+        self.n_seen=0
+        self.sums=np.zeros((4,n_col)) # sums of r, r^2, r^3, r^4
+        self.neg_sums=np.zeros((3,n_col)) # count, sum and sum of squares of the negative returns
+        self.log_excess=np.zeros(n_col) # sum of log(1+excess return), for the compounded excess return
+        self.log_wealth=np.zeros(n_col)
+        self.peak=np.full(n_col,-np.inf) # running peak of log wealth for the expanding window
+        self.sorted_r=np.empty((n_col,window if window is not None else 64)) # row j is column j sorted
+        if window is not None:
+            # ring buffers of the returns and log wealth in the window
+            self.buffer_r=np.empty((window,n_col))
+            self.buffer_log_wealth=np.empty((window,n_col))
+
+    def add(self,r,sign):
+        """add (sign=1) or remove (sign=-1) one row of returns from the running sums, NaNs count as absent"""
+        is_valid=~np.isnan(r)
+        r=np.where(is_valid,r,0)
+        self.n+=sign*is_valid
+        self.sums+=sign*r**np.arange(1,5)[:,None]
+        is_negative=r<0
+        self.neg_sums+=sign*is_negative*r**np.arange(3)[:,None]
+        self.log_excess+=sign*np.where(is_valid,np.log1p(r-self.rf_per_period),0)
+
+    def update(self,r):
+        """append one row of returns, return the metrics of the new window as a dict of length N arrays"""
+        r=np.asarray(r,dtype=float)
+        self.log_wealth=self.log_wealth+np.log1p(np.nan_to_num(r,nan=0.0))
+        if self.window is None:
+            self.peak=np.maximum(self.peak,self.log_wealth)
+            peak=self.peak
+        else:
+            slot=self.n_seen%self.window
+            if self.n_rows==self.window:
+                old_r=self.buffer_r[slot]
+                remove_sorted(self.sorted_r,self.n,old_r)
+                self.add(old_r,-1)
+                self.n_rows-=1
+            self.buffer_r[slot]=r
+            self.buffer_log_wealth[slot]=self.log_wealth
+            peak=self.buffer_log_wealth[:min(self.n_seen+1,self.window)].max(axis=0)
+        if self.n.max(initial=0)==self.sorted_r.shape[1]:
+            self.sorted_r=np.hstack([self.sorted_r,np.empty_like(self.sorted_r)])
+        insert_sorted(self.sorted_r,self.n,r)
+        self.add(r,1)
+        self.n_rows+=1
+        self.n_seen+=1
+        return self.stats(peak)
+
+    def stats(self,peak):
+        """metrics of the current window, NaN for the columns without enough valid returns"""
+        n_col=len(self.columns)
+        is_ready=self.n>=(2 if self.window is None else max(self.window,2))
+        if not is_ready.any():
+            return {metric:np.full(n_col,np.nan) for metric in self.metrics}
+        n=np.maximum(self.n,2) # columns that are not ready are masked at the end
+        mean=self.sums[0]/n
+        e2,e3,e4=self.sums[1:]/n
+        m2=e2-mean**2
+        m3=e3-3*mean*e2+2*mean**3
+        m4=e4-4*mean*e3+6*mean**2*e2-3*mean**4
+        n_neg,neg_sum,neg_sum2=self.neg_sums
+        with np.errstate(invalid='ignore',divide='ignore'):
+            ann_vol=np.sqrt(m2*n/(n-1)*self.periods_per_year)
+            sharpe_ratio=np.expm1(self.log_excess*self.periods_per_year/n)/ann_vol
+            semideviation=np.sqrt(neg_sum2/n_neg-(neg_sum/n_neg)**2)
+            skewness=m3/m2**1.5
+            kurtosis=m4/m2**2
+        # percentile with numpy's default linear interpolation, per column as the counts may differ
+        h=(n-1)*self.level/100
+        lo=np.floor(h).astype(int)
+        rows=np.arange(n_col)
+        sorted_r=self.sorted_r
+        q=sorted_r[rows,lo]+(h-lo)*(sorted_r[rows,np.minimum(lo+1,n-1)]-sorted_r[rows,lo])
+        # only the lower tail is summed for the cvar, widened past lo+1 while ties with q remain
+        k=lo.max()+1
+        while (k<n).any() and (sorted_r[:,min(k,sorted_r.shape[1]-1)][k<n]<=q[k<n]).any():
+            k+=1
+        tail=sorted_r[:,:k]
+        is_beyond=(tail<=q[:,None])&(np.arange(k)<n[:,None])
+        with np.errstate(invalid='ignore',divide='ignore'):
+            cvar=-np.where(is_beyond,tail,0).sum(axis=1)/is_beyond.sum(axis=1)
+        result={
+            'annualized vol':ann_vol,
+            'sharpe ratio':sharpe_ratio,
+            'skewness':skewness,
+            'kurtosis':kurtosis,
+            'semideviation':semideviation,
+            'historic var':-q,
+            'historic cvar':cvar,
+            'drawdown':np.expm1(self.log_wealth-peak)
+        }
+        return {metric:np.where(is_ready,value,np.nan) for metric,value in result.items()}
+
+    def append(self,r):
+        """append a dataframe (or T*N array) of returns, return a dict of T*N dataframes, one per metric"""
+        index=r.index if isinstance(r,pd.DataFrame) else None
+        rows=[self.update(row) for row in np.asarray(r,dtype=float).reshape(-1,len(self.columns))]
+        return {metric:pd.DataFrame(np.array([row[metric] for row in rows]).reshape(-1,len(self.columns)),
+                                    index=index,columns=self.columns)
+                for metric in self.metrics}
+
+def rolling_stats(r,window=36,periods_per_year=12,riskfree_rate=0.03,level=5):
+    """rolling (or expanding if window is None) risk metrics of every column of a dataframe of returns
+    return a dict of dataframes, one per metric, see RollingRisk"""
+    if isinstance(r,pd.Series):
+        r=r.to_frame()
+    return RollingRisk(r.columns,window,periods_per_year,riskfree_rate,level).append(r)
+
 def portfolio_return(weights,returns):
     """weights to returns"""
     return weights.T@returns
@@ -157,68 +395,196 @@ def plot_ef2(n_points,er,cov,style=".-"):
 
 import numpy as np
 from scipy.optimize import minimize
-def minimize_vol(target_r,er,cov):
-    """target return to W"""
+def portfolio_vol_grad(weights,covmat):
+    """analytic gradient of portfolio_vol with respect to the weights"""
+    cov_w=np.asarray(covmat@weights)
+    return cov_w/np.sqrt(weights@cov_w)
+
+def neg_sharpe_ratio(weights,riskfree_rate,er,cov):
+    """minimize the negative sharpe ratio to get the max value"""
+    r=portfolio_return(weights,er)
+    vol=portfolio_vol(weights,cov)
+    return -(r-riskfree_rate)/vol
+
+def neg_sharpe_ratio_grad(weights,riskfree_rate,er,cov):
+    """analytic gradient of neg_sharpe_ratio with respect to the weights"""
+    cov_w=np.asarray(cov@weights)
+    vol=np.sqrt(weights@cov_w)
+    excess_r=portfolio_return(weights,er)-riskfree_rate
+    return -(np.asarray(er)/vol-excess_r*cov_w/vol**3)
+
+def minimize_vol(target_r,er,cov,init_guess=None):
+    """target return to W, init_guess warm starts the optimizer (equal weights by default)"""
     n=er.shape[0]
-    init_guess=np.repeat(1/n,n)
+    if init_guess is None:
+        init_guess=np.repeat(1/n,n)
     bounds=((0,1),)*n
     return_is_target={
         'type':'eq',
         'args':(er,),
-        'fun':lambda weights, er:target_r-portfolio_return(weights,er)
+        'fun':lambda weights, er:target_r-portfolio_return(weights,er),
+        'jac':lambda weights, er:-np.asarray(er,dtype=float)
     }
     weights_sum_to_1={
         'type':'eq',
-        'fun':lambda weights: np.sum(weights)-1
+        'fun':lambda weights: np.sum(weights)-1,
+        'jac':lambda weights: np.ones_like(weights)
     }
     results=minimize(portfolio_vol,init_guess,
-                    args=(cov,),method='SLSQP',options={'disp':False},
+                    args=(cov,),jac=portfolio_vol_grad,method='SLSQP',options={'disp':False},
                     constraints=(return_is_target,weights_sum_to_1),
                     bounds=bounds)
     return results.x
 
 import pandas as pd
 def optiminal_weights(n_points,er,cov):
-    """generate list of weights to run the optimizer to minimize the vol"""
+    """generate list of weights to run the optimizer to minimize the vol
+    each point is warm started from the solution of the previous one"""
     target_rs=np.linspace(er.min(),er.max(),n_points)
-    weights=[minimize_vol(target_return,er,cov) for target_return in target_rs]
+    weights=[]
+    init_guess=None
+    for target_return in target_rs:
+        init_guess=minimize_vol(target_return,er,cov,init_guess)
+        weights.append(init_guess)
     return weights
 
 from scipy.optimize import minimize
-def msr(riskfree_rate,er,cov):
-    """rf rate, er, cov to W"""
+def msr(riskfree_rate,er,cov,init_guess=None):
+    """rf rate, er, cov to W, init_guess warm starts the optimizer (equal weights by default)"""
     n=er.shape[0]
-    init_guess=np.repeat(1/n,n)
+    if init_guess is None:
+        init_guess=np.repeat(1/n,n)
     bounds=((0,1),)*n
 
     weights_sum_to_1={
         'type':'eq',
-        'fun':lambda weights: np.sum(weights)-1
+        'fun':lambda weights: np.sum(weights)-1,
+        'jac':lambda weights: np.ones_like(weights)
     }
-    def neg_sharpe_ratio(weights,riskfree_rate,er,cov):
-        """minimize the negative sharpe ratio to get the max value"""
-        r=portfolio_return(weights,er)
-        vol=portfolio_vol(weights,cov)
-        return -(r-riskfree_rate)/vol
-    
     results=minimize(neg_sharpe_ratio,init_guess,
-                    args=(riskfree_rate,er,cov,),method='SLSQP',options={'disp':False},
+                    args=(riskfree_rate,er,cov,),jac=neg_sharpe_ratio_grad,method='SLSQP',options={'disp':False},
                     constraints=(weights_sum_to_1),
                     bounds=bounds)
     return results.x
-def gmv(cov):
+def gmv(cov,init_guess=None):
     """return the weights of the global min vol portfolio given cov matrix
     call msr function, input the same ER (if all ER are the same, the only way to increase sharpe ratio is through min vol
     """
     n=cov.shape[0]
-    return msr(0,np.repeat(1,n),cov)
+    return msr(0,np.repeat(1,n),cov,init_guess)
+
+def active_set_qp(cov,A,b,w0,tol=1e-10,max_iter=None):
+    """solve min w'cov w s.t. A w = b, w >= 0 with a primal active-set method
+    w0 must be feasible, starting from a nearby solution keeps the number of iterations small"""
+    cov=np.asarray(cov,dtype=float)
+    A=np.atleast_2d(np.asarray(A,dtype=float))
+    b=np.atleast_1d(np.asarray(b,dtype=float))
+    n,n_eq=cov.shape[0],A.shape[0]
+    if max_iter is None: max_iter=10*n+10
+    w=np.array(w0,dtype=float)
+    at_zero=w<=tol # working set of the w >= 0 bounds
+    w[at_zero]=0
+    z_tol=tol*np.abs(np.diag(cov)).max()
+    for _ in range(max_iter):
+        free=~at_zero
+        k=free.sum()
+        # KKT system of the equality constrained problem on the free weights
+        kkt=np.zeros((k+n_eq,k+n_eq))
+        kkt[:k,:k]=cov[np.ix_(free,free)]
+        kkt[:k,k:]=-A[:,free].T
+        kkt[k:,:k]=A[:,free]
+        solution=np.linalg.lstsq(kkt,np.concatenate([np.zeros(k),b]),rcond=None)[0]
+        step=-w
+        step[free]+=solution[:k]
+        if np.abs(step).max()<=tol:
+            # multipliers of the bounds, release the most negative one or stop
+            z=cov@w-A.T@solution[k:]
+            z[free]=np.inf
+            j=np.argmin(z)
+            if z[j]>=-z_tol:
+                break
+            at_zero[j]=False
+            continue
+        blocking=np.flatnonzero(free&(step<-tol))
+        ratios=-w[blocking]/step[blocking]
+        if len(ratios)>0 and ratios.min()<1:
+            j=blocking[np.argmin(ratios)]
+            w+=ratios.min()*step
+            w[j]=0
+            at_zero[j]=True
+        else:
+            w+=step
+    return w
+
+def efficient_frontier(n_points,er,cov,riskfree_rate=0,method='slsqp'):
+    """long only efficient frontier together with the GMV and MSR portfolios
+    cov is factorized once, points whose closed form (unconstrained) solution is already long only skip the solver
+    the other points are warm started from the previous one and solved with
+    method='slsqp' (minimize_vol with analytic gradients) or method='active_set' (active_set_qp)
+    return a dict with the frontier Returns/Volatility, the Weights of every point, GMV and MSR weights"""
+    if method not in ('slsqp','active_set'):
+        raise ValueError("method should be 'slsqp' or 'active_set'")
+    names=er.index if isinstance(er,pd.Series) else None
+    er=np.asarray(er,dtype=float)
+    cov=np.asarray(cov,dtype=float)
+    n=er.shape[0]
+    ones=np.ones(n)
+    # one cholesky factorization of cov serves gmv, msr and every frontier point
+    inv_1,inv_er=scipy.linalg.cho_solve(scipy.linalg.cho_factor(cov),np.column_stack([ones,er])).T
+    a,b,c=ones@inv_1,ones@inv_er,er@inv_er
+    d=a*c-b**2
+    i_max=np.argmax(er)
+
+    def towards_max(w,target):
+        """feasible start for a target return: mix w with the highest return asset"""
+        r=er@w
+        alpha=(er[i_max]-target)/(er[i_max]-r) if er[i_max]>r else 1
+        start=alpha*w
+        start[i_max]+=1-alpha
+        return start
+
+    target_rs=np.linspace(er.min(),er.max(),n_points)
+    weights=np.empty((n_points,n))
+    w=np.eye(n)[np.argmin(er)]
+    for i,target in enumerate(target_rs):
+        closed_form=((c-b*target)*inv_1+(a*target-b)*inv_er)/d if d>0 else -ones
+        if closed_form.min()>=0:
+            w=closed_form
+        elif method=='active_set':
+            w=active_set_qp(cov,np.vstack([ones,er]),[1,target],towards_max(w,target))
+        else:
+            w=minimize_vol(target,er,cov,w)
+        weights[i]=w
+    rets=weights@er
+    vols=np.sqrt(np.einsum('ij,jk,ik->i',weights,cov,weights))
+
+    w_gmv=inv_1/a
+    if w_gmv.min()<0:
+        start=weights[np.argmin(vols)]
+        w_gmv=active_set_qp(cov,ones,1,start) if method=='active_set' else gmv(cov,start)
+
+    excess_er=er-riskfree_rate
+    w_msr=(inv_er-riskfree_rate*inv_1)/(b-riskfree_rate*a) if b-riskfree_rate*a>0 else -ones
+    if w_msr.min()<0:
+        start=weights[np.argmax((rets-riskfree_rate)/vols)]
+        if method=='active_set' and excess_er@start>0:
+            # max sharpe as a QP: min y'cov y s.t. excess_er'y = 1, y >= 0, then rescale y to weights
+            y=active_set_qp(cov,excess_er,1,start/(excess_er@start))
+            w_msr=y/y.sum()
+        else:
+            w_msr=msr(riskfree_rate,er,cov,start)
+    return {
+        'Frontier':pd.DataFrame({'Returns':rets,'Volatility':vols}),
+        'Weights':pd.DataFrame(weights,columns=names),
+        'GMV':pd.Series(w_gmv,index=names),
+        'MSR':pd.Series(w_msr,index=names),
+        'riskfree_rate':riskfree_rate
+    }
     
-def plot_ef(n_points,er,cov,style=".-",show_cml=False,riskfree_rate=0, show_ew=False, show_gmv=False):
-    """plot N assets ef"""
-    weights=optiminal_weights(n_points,er,cov)
-    rets=[portfolio_return(w,er) for w in weights]
-    vols=[portfolio_vol(w,cov) for w in weights]
-    ef=pd.DataFrame({'Returns':rets,'Volatility':vols})
+def plot_ef(n_points,er,cov,style=".-",show_cml=False,riskfree_rate=0, show_ew=False, show_gmv=False, method='slsqp'):
+    """plot N assets ef, the frontier, GMV and MSR all come from one efficient_frontier call"""
+    frontier=efficient_frontier(n_points,er,cov,riskfree_rate,method)
+    ef=frontier['Frontier']
     ax= ef.plot.line(x='Volatility',y='Returns',style=style)
     if show_ew:
         n=er.shape[0]
@@ -228,7 +594,7 @@ def plot_ef(n_points,er,cov,style=".-",show_cml=False,riskfree_rate=0, show_ew=F
         # display EW
         ax.plot([vol_ew],[r_ew],color='goldenrod',marker='o',markersize=12)
     if show_gmv:
-        w_gmv=gmv(cov)
+        w_gmv=frontier['GMV'].values
         
         r_gmv=portfolio_return(w_gmv,er)
         vol_gmv=portfolio_vol(w_gmv,cov)
@@ -237,7 +603,7 @@ def plot_ef(n_points,er,cov,style=".-",show_cml=False,riskfree_rate=0, show_ew=F
     if show_cml:
         ax.set_xlim(left=0) ##set x axis limit to start with 0
         
-        w_msr=msr(riskfree_rate,er,cov)
+        w_msr=frontier['MSR'].values
         r_msr=portfolio_return(w_msr,er)
         vol_msr=portfolio_vol(w_msr,cov)
         # add CML
@@ -246,8 +612,9 @@ def plot_ef(n_points,er,cov,style=".-",show_cml=False,riskfree_rate=0, show_ew=F
         ax.plot(cml_x,cml_y,color='green',marker='o',linestyle='dashed',markersize=12,linewidth=2)
     return ax
 
-def run_cppi(risky_r,safe_r=None,m=3,start=1000,floor=0.8,riskfree_rate=0.03,drawdown=None):
-    """run a backtest of CPPI strategy, given a set of returns of risky assets"""
+def run_cppi0(risky_r,safe_r=None,m=3,start=1000,floor=0.8,riskfree_rate=0.03,drawdown=None):
+    """run a backtest of CPPI strategy, given a set of returns of risky assets
+    reference step-by-step version, see run_cppi for the vectorized engine"""
     # set up CPPI parameters
     dates=risky_r.index
     n_steps=len(dates)
@@ -295,7 +662,231 @@ def run_cppi(risky_r,safe_r=None,m=3,start=1000,floor=0.8,riskfree_rate=0.03,dra
     }
     return backtest_result
 
+def cppi_paths(risky_r,safe_r,m=3,start=1000,floor=0.8,drawdown=None,dtype=np.float64):
+    """CPPI engine on numpy arrays, all scenarios are moved forward together at each step
+    risky_r is a T*N array of returns, safe_r is anything that broadcasts to it (T*N, T*1 or a scalar)
+    m and floor are scalars or K*1 arrays, in which case K parameter sets are run at once
+    return the account value, cushion and risky weight histories, each T*N (or T*K*N)
+    the histories are stored in dtype, the running account is always float64"""
+    risky_r=np.asarray(risky_r)
+    safe_r=np.broadcast_to(np.asarray(safe_r,dtype=float),risky_r.shape)
+    m=np.asarray(m,dtype=float)
+    floor=np.asarray(floor,dtype=float)
+    n_steps=risky_r.shape[0]
+    shape=np.broadcast_shapes(m.shape,floor.shape,risky_r.shape[1:])
+    account_value=np.full(shape,float(start))
+    floor_value=np.broadcast_to(start*floor,shape)
+    peak=account_value.copy()
+    account_history=np.empty((n_steps,)+shape,dtype=dtype)
+    cushion_history=np.empty_like(account_history)
+    risky_w_history=np.empty_like(account_history)
+    for step in range(n_steps):
+        if drawdown is not None:
+            np.maximum(peak,account_value,out=peak)
+            floor_value=peak*(1-drawdown)
+        cushion=(account_value-floor_value)/account_value
+        risky_w=np.clip(m*cushion,0,1)
+        risky_alloc=account_value*risky_w
+        safe_alloc=account_value*(1-risky_w)
+        account_value=risky_alloc*(1+risky_r[step])+safe_alloc*(1+safe_r[step])
+        cushion_history[step]=cushion
+        account_history[step]=account_value
+        risky_w_history[step]=risky_w
+    return account_history,cushion_history,risky_w_history
+
+def run_cppi(risky_r,safe_r=None,m=3,start=1000,floor=0.8,riskfree_rate=0.03,drawdown=None,
+             output='pandas',dtype=np.float64):
+    """run a backtest of CPPI strategy, given a set of returns of risky assets
+    same result as run_cppi0, but all scenarios are stepped together through cppi_paths
+    m and floor also accept lists of values: every (m, floor) pair is run in the same call and
+    the histories come back with (m, floor, scenario) MultiIndex columns
+    output='numpy' returns a SimResult holding the histories as dtype arrays (T*N or T*K*N) and the inputs as passed,
+    risky_r can then also be a T*N array"""
+    if output=='numpy':
+        return run_cppi_arrays(risky_r,safe_r,m,start,floor,riskfree_rate,drawdown,dtype)
+    if isinstance(risky_r, pd.Series):
+        risky_r=pd.DataFrame(risky_r,columns=['R'])
+    if safe_r is None:
+        safe_r=pd.DataFrame(data=riskfree_rate/12,index=risky_r.index,columns=risky_r.columns)
+    columns=risky_r.columns
+    m_grid,floor_grid=m,floor
+    if np.ndim(m)>0 or np.ndim(floor)>0:
+        # sensitivity sweep, one row of parameters per (m, floor) pair
+        grid=pd.MultiIndex.from_product([np.atleast_1d(m),np.atleast_1d(floor)],names=['m','floor'])
+        m_grid=grid.get_level_values('m').values[:,None]
+        floor_grid=grid.get_level_values('floor').values[:,None]
+        columns=pd.MultiIndex.from_tuples([g+(c,) for g in grid for c in risky_r.columns],
+                                          names=['m','floor',risky_r.columns.name])
+    account_history,cushion_history,risky_w_history=cppi_paths(risky_r.values,np.asarray(safe_r),
+                                                               m_grid,start,floor_grid,drawdown)
+    n_steps=risky_r.shape[0]
+    def as_frame(history):
+        return pd.DataFrame(history.reshape(n_steps,-1),index=risky_r.index,columns=columns)
+    risky_wealth=start*(1+risky_r).cumprod()
+    backtest_result={
+          "Wealth":as_frame(account_history),
+          'Risky Wealth':risky_wealth,
+          'Risky Budget':as_frame(cushion_history),
+          'Risky Allocation':as_frame(risky_w_history),
+          'm':m,
+          'start':start,
+          'floor':floor,
+          'risky_r':risky_r,
+          'safe_r':safe_r
+    }
+    return backtest_result
+
+class SimResult:
+    """compact result of a simulation or backtest, the output='numpy' mode of run_cppi
+    keys work as in the result dict, arrays come back in their storage dtype and inputs by reference,
+    frame(key) and to_dict() build the pandas objects only when asked for,
+    builders maps a key to a function building its pandas value in to_dict (e.g. the default safe_r frame)"""
+    __slots__=('arrays','params','index','columns','builders')
+
+    def __init__(self,arrays,params=None,index=None,columns=None,builders=None):
+        self.arrays=arrays
+        self.params={} if params is None else params
+        self.index=index
+        self.columns={} if columns is None else columns
+        self.builders={} if builders is None else builders
+
+    def __getitem__(self,key):
+        return self.arrays[key] if key in self.arrays else self.params[key]
+
+    def keys(self):
+        return list(self.arrays)+list(self.params)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def frame(self,key):
+        """T*N dataframe view of one array, the grid dimension of a sweep is folded into the columns"""
+        a=self.arrays[key]
+        return pd.DataFrame(a.reshape(a.shape[0],-1),index=self.index,columns=self.columns.get(key),copy=False)
+
+    def to_dict(self):
+        """the result of the default pandas output"""
+        result=dict({key:self.frame(key) for key in self.arrays},**self.params)
+        result.update((key,build()) for key,build in self.builders.items())
+        return result
+
+def rate_frame(rate,index,columns,shape):
+    """constant dataframe of a per period rate, the safe_r run_cppi builds when none is given"""
+    return pd.DataFrame(np.full(shape,rate),index=index,columns=columns)
+
+def run_cppi_arrays(risky_r,safe_r=None,m=3,start=1000,floor=0.8,riskfree_rate=0.03,drawdown=None,dtype=np.float64):
+    """run_cppi without dataframes, see run_cppi(output='numpy')"""
+    index=columns=None
+    if isinstance(risky_r,(pd.Series,pd.DataFrame)):
+        index=risky_r.index
+        columns=risky_r.columns if isinstance(risky_r,pd.DataFrame) else pd.Index(['R'])
+    risky=np.asarray(risky_r)
+    if risky.ndim==1:
+        risky=risky[:,None]
+    safe=riskfree_rate/12 if safe_r is None else np.asarray(safe_r)
+    m_grid,floor_grid=m,floor
+    grid_columns=columns
+    if np.ndim(m)>0 or np.ndim(floor)>0:
+        grid=pd.MultiIndex.from_product([np.atleast_1d(m),np.atleast_1d(floor)],names=['m','floor'])
+        m_grid=grid.get_level_values('m').values[:,None]
+        floor_grid=grid.get_level_values('floor').values[:,None]
+        base=columns if columns is not None else pd.RangeIndex(risky.shape[1])
+        grid_columns=pd.MultiIndex.from_tuples([g+(c,) for g in grid for c in base],
+                                               names=['m','floor',base.name])
+    account_history,cushion_history,risky_w_history=cppi_paths(risky,safe,m_grid,start,floor_grid,drawdown,dtype)
+    risky_wealth=np.add(risky,1,dtype=dtype)
+    np.cumprod(risky_wealth,axis=0,out=risky_wealth)
+    risky_wealth*=start
+    builders={}
+    if isinstance(risky_r,pd.Series):
+        builders['risky_r']=functools.partial(pd.DataFrame,risky_r,columns=['R'])
+    if safe_r is None:
+        builders['safe_r']=functools.partial(rate_frame,riskfree_rate/12,index,columns,risky.shape)
+    return SimResult({'Wealth':account_history,
+                      'Risky Wealth':risky_wealth,
+                      'Risky Budget':cushion_history,
+                      'Risky Allocation':risky_w_history},
+                     {'m':m,'start':start,'floor':floor,'risky_r':risky_r,'safe_r':safe_r},
+                     index=index,
+                     columns={'Wealth':grid_columns,'Risky Wealth':columns,
+                              'Risky Budget':grid_columns,'Risky Allocation':grid_columns},
+                     builders=builders)
+
+def risk_stats_kernel(r,riskfree_rate=0.03,periods_per_year=12,level=5):
+    """compute every column's risk statistics from a T*N numpy array of returns without missing values
+    the moments, the compounding and the drawdowns are each computed once and shared between the statistics
+    return a dict of length N arrays"""
+    r=np.asarray(r,dtype=float)
+    n_periods=r.shape[0]
+    mean=r.mean(axis=0)
+    demeaned_r=r-mean
+    demeaned_r2=demeaned_r**2
+    m2=demeaned_r2.mean(axis=0)
+    m3=(demeaned_r2*demeaned_r).mean(axis=0)
+    m4=(demeaned_r2**2).mean(axis=0)
+    sigma_r=np.sqrt(m2)
+    s=m3/sigma_r**3
+    k=m4/m2**2
+    ann_vol=np.sqrt(m2*n_periods/(n_periods-1)*periods_per_year)
+    wealth=np.cumprod(1+r,axis=0)
+    ann_r=wealth[-1]**(periods_per_year/n_periods)-1
+    rf_per_period=(1+riskfree_rate)**(1/periods_per_year)-1
+    ann_ex_r=np.prod(1+(r-rf_per_period),axis=0)**(periods_per_year/n_periods)-1
+    previous_peaks=np.maximum.accumulate(wealth,axis=0)
+    max_dd=((wealth-previous_peaks)/previous_peaks).min(axis=0)
+    z=norm.ppf(level/100)
+    z=(z + (z**2 - 1)*s/6 + (z**3 - 3*z)*(k-3)/24 - (2 * z**3 - 5*z)*(s**2)/36)
+    cf_var=-(mean+z*sigma_r)
+    percentile=np.percentile(r,level,axis=0)
+    is_beyond=r<=percentile
+    hist_cvar=-(r*is_beyond).sum(axis=0)/is_beyond.sum(axis=0)
+    return {
+        'annualized return':ann_r,
+        'annualized vol':ann_vol,
+        'skewness':s,
+        'kurtosis':k,
+        'cornish-fisher var':cf_var,
+        'historic var':-percentile,
+        'historic cvar':hist_cvar,
+        'sharpe ratio':ann_ex_r/ann_vol,
+        'max drawdown':max_dd
+    }
+
 def summary_stats(r,riskfree_rate=0.03):
+    """r is a dataframe of returns, or an iterable of T*N return blocks (see gbm_blocks),
+    in which case the stats are computed block by block, one row per scenario
+    the statistics come from risk_stats_kernel, one call per distinct history span: a column whose missing values
+    are all before its first or after its last return (a fund launched or closed mid sample) is measured over
+    its own history, only columns with gaps inside their history go through summary_stats0"""
+    if is_blocks(r):
+        return pd.concat([summary_stats(pd.DataFrame(block),riskfree_rate) for block in r],ignore_index=True)
+    if isinstance(r,pd.Series):
+        r=r.to_frame()
+    values=r.values.astype(float)
+    is_valid=~np.isnan(values)
+    n_valid=is_valid.sum(axis=0)
+    first=is_valid.argmax(axis=0)
+    last=values.shape[0]-1-is_valid[::-1].argmax(axis=0)
+    is_span=(n_valid>1)&(n_valid==last-first+1) # the valid returns are one contiguous block
+    spans={}
+    for j in np.flatnonzero(is_span):
+        spans.setdefault((first[j],last[j]),[]).append(j)
+    names=['annualized return','annualized vol','skewness','kurtosis','cornish-fisher var 5%',
+           'historic cvar 5%','sharpe ratio','max drawdown']
+    result=np.full((values.shape[1],len(names)),np.nan)
+    for (start,end),columns in spans.items():
+        stats=risk_stats_kernel(values[start:end+1,columns],riskfree_rate)
+        result[columns]=np.column_stack([stats['annualized return'],stats['annualized vol'],stats['skewness'],
+                                         stats['kurtosis'],stats['cornish-fisher var'],stats['historic cvar'],
+                                         stats['sharpe ratio'],stats['max drawdown']])
+    gaps=np.flatnonzero(~is_span)
+    if len(gaps):
+        result[gaps]=summary_stats0(r.iloc[:,gaps],riskfree_rate)[names].values
+    return pd.DataFrame(result,index=r.columns,columns=names)
+
+def summary_stats0(r,riskfree_rate=0.03):
+    """reference version of summary_stats, one aggregate per statistic"""
     ann_r=r.aggregate(annualized_rets,periods_per_year=12)
     ann_vol=r.aggregate(annualized_vol,periods_per_year=12)
     ann_sr=r.aggregate(sharpe_ratio,riskfree_rate=riskfree_rate,periods_per_year=12)
@@ -324,7 +915,8 @@ def gbm0(n_years=10, n_scenarios=1000, mu=0.17, sigma=0.15, steps_per_year=12,s_
     prices=s_0*pd.DataFrame(rets_plus_one).cumprod()
     return prices  
 
-def gbm(n_years = 10, n_scenarios=1000, mu=0.07, sigma=0.15, steps_per_year=12, s_0=100.0, prices=True):
+def gbm(n_years = 10, n_scenarios=1000, mu=0.07, sigma=0.15, steps_per_year=12, s_0=100.0, prices=True,
+        method='mc', seed=None, n_replicates=16, output='pandas', dtype=np.float64):
     """
     Evolution of Geometric Brownian Motion trajectories, such as for Stock Prices through Monte Carlo
     :param n_years:  The number of years to generate data for
@@ -333,30 +925,126 @@ def gbm(n_years = 10, n_scenarios=1000, mu=0.07, sigma=0.15, steps_per_year=12,
     :param sigma: Annualized Volatility
     :param steps_per_year: granularity of the simulation
     :param s_0: initial value
+    :param method: 'mc' plain draws, 'antithetic' mirrored halves or 'sobol' scrambled Sobol points with a Brownian bridge
+    :param seed: seed of the draws, 'mc' without a seed uses the global np.random state as before
+    :param n_replicates: number of independent Sobol scrambles, the standard errors of mc_estimate come from them
+    :param output: 'numpy' returns prices as an array too, computed in place without a dataframe
+    :param dtype: storage dtype of the result, np.float32 halves its memory
     :return: a numpy array of n_paths columns and n_years*steps_per_year rows
     """
     # Derive per-step Model Parameters from User Specifications
     dt = 1/steps_per_year
     n_steps = int(n_years*steps_per_year) + 1
-    # the standard way ...
-    # rets_plus_1 = np.random.normal(loc=mu*dt+1, scale=sigma*np.sqrt(dt), size=(n_steps, n_scenarios))
-    # without discretization error ...
-    rets_plus_1 = np.random.normal(loc=(1+mu)**dt, scale=(sigma*np.sqrt(dt)), size=(n_steps, n_scenarios))
+    if method=='mc' and seed is None:
+        # the standard way ...
+        # rets_plus_1 = np.random.normal(loc=mu*dt+1, scale=sigma*np.sqrt(dt), size=(n_steps, n_scenarios))
+        # without discretization error ...
+        rets_plus_1 = np.random.normal(loc=(1+mu)**dt, scale=(sigma*np.sqrt(dt)), size=(n_steps, n_scenarios))
+    else:
+        rets_plus_1 = np.empty((n_steps, n_scenarios))
+        rets_plus_1[1:] = (1+mu)**dt + sigma*np.sqrt(dt)*gbm_shocks(n_steps-1, n_scenarios, method, seed, n_replicates)
     rets_plus_1[0] = 1
+    rets_plus_1 = rets_plus_1.astype(dtype, copy=False)
+    if output=='numpy':
+        if prices:
+            np.cumprod(rets_plus_1, axis=0, out=rets_plus_1)
+            rets_plus_1 *= s_0
+        else:
+            rets_plus_1 -= 1
+        return rets_plus_1
     ret_val = s_0*pd.DataFrame(rets_plus_1).cumprod() if prices else rets_plus_1-1
     return ret_val
 
+def gbm_shocks(n_steps,n_scenarios,method='mc',seed=None,n_replicates=16):
+    """n_steps*n_scenarios standard normal shocks
+    'antithetic' puts -z in the second half of the columns, so column j and j+n_scenarios/2 are a pair
+    'sobol' stacks n_replicates independently scrambled Sobol blocks of n_scenarios/n_replicates columns,
+    the first Sobol coordinates drive the coarse moves of the path through a Brownian bridge"""
+    rng=np.random.default_rng(seed)
+    if method=='mc':
+        return rng.standard_normal(size=(n_steps,n_scenarios))
+    if method=='antithetic':
+        if n_scenarios%2:
+            raise ValueError('antithetic draws need an even n_scenarios')
+        z=rng.standard_normal(size=(n_steps,n_scenarios//2))
+        return np.hstack([z,-z])
+    if method=='sobol':
+        if n_scenarios%n_replicates:
+            raise ValueError('n_scenarios must be a multiple of n_replicates')
+        size=n_scenarios//n_replicates
+        blocks=[]
+        for child in np.random.SeedSequence(seed).spawn(n_replicates):
+            u=scipy.stats.qmc.Sobol(d=n_steps,scramble=True,seed=np.random.default_rng(child)).random(size)
+            blocks.append(brownian_bridge(scipy.stats.norm.ppf(np.clip(u,1e-12,1-1e-12)).T))
+        return np.hstack(blocks)
+    raise ValueError('method must be mc, antithetic or sobol')
+
+def brownian_bridge(z):
+    """turn n_steps*n rows of normals, most important first, into n_steps*n standard Brownian increments
+    row 0 sets the end point, the next rows fill midpoints by bisection"""
+    n_steps=z.shape[0]
+    w=np.zeros((n_steps+1,)+z.shape[1:])
+    w[n_steps]=np.sqrt(n_steps)*z[0]
+    intervals=[(0,n_steps)]
+    k=1
+    for left,right in intervals:
+        if right-left<2:
+            continue
+        mid=(left+right)//2
+        w[mid]=((right-mid)*w[left]+(mid-left)*w[right])/(right-left)+np.sqrt((mid-left)*(right-mid)/(right-left))*z[k]
+        k+=1
+        intervals+=[(left,mid),(mid,right)]
+    return np.diff(w,axis=0)
+
+def gbm_terminal_mean(n_years=10,mu=0.07):
+    """expected terminal value of a dollar under gbm, each step grows by (1+mu)**dt on average
+    the known mean that makes terminal_values of gbm returns a control variate"""
+    return (1+mu)**n_years
+
+def block_rngs(n_scenarios,block_size,seed=None):
+    """yield (Generator, size) for each block of at most block_size scenarios
+    every block gets its own child of SeedSequence(seed), so a seed always reproduces the same blocks"""
+    n_blocks=-(-n_scenarios//block_size)
+    for i,child in enumerate(np.random.SeedSequence(seed).spawn(n_blocks)):
+        yield np.random.default_rng(child),min(block_size,n_scenarios-i*block_size)
+
+def is_blocks(r):
+    """True if r is an iterable of scenario blocks rather than a single series/dataframe/array"""
+    return not isinstance(r,(pd.DataFrame,pd.Series,np.ndarray))
+
+def gbm_blocks(n_years=10, n_scenarios=1000, mu=0.07, sigma=0.15, steps_per_year=12, s_0=100.0, prices=True,
+               block_size=10000, seed=None):
+    """
+    Streaming version of gbm, yields the scenarios as numpy arrays of at most block_size columns
+    so that the full path matrix is never held in memory at once
+    :param block_size: number of scenarios per block
+    :param seed: seed of the SeedSequence the per-block generators are spawned from
+    :return: a generator of (n_years*steps_per_year+1)*block_size arrays of prices (or returns if prices=False)
+    """
+    dt = 1/steps_per_year
+    n_steps = int(n_years*steps_per_year) + 1
+    for rng,size in block_rngs(n_scenarios,block_size,seed):
+        rets_plus_1 = rng.normal(loc=(1+mu)**dt, scale=(sigma*np.sqrt(dt)), size=(n_steps, size))
+        rets_plus_1[0] = 1
+        if prices:
+            # in place, no extra copy of the block
+            np.cumprod(rets_plus_1, axis=0, out=rets_plus_1)
+            rets_plus_1 *= s_0
+        else:
+            rets_plus_1 -= 1
+        yield rets_plus_1
+
 def discount0(t,r):
     """compute the price of a pure discount bond that pay 1 dollar at time t given int rate r, assume int rate is flat"""
     return (1+r)**(-t)
 
 def discount(t,r):
     """compute the price of a pure discount bond that pays 1 dollar at time period t
-    r is the per period int rate
-    returns a t*r series dataframe indexed by t"""
-    discounts=pd.DataFrame([(r+1)**-i for i in t])
-    discounts.index=t
-    return discounts
+    r is the per period int rate, a scalar or a vector of rates (one column each)
+    returns a t*r series dataframe indexed by t, built in one broadcast"""
+    rates=np.atleast_1d(np.asarray(r,dtype=float))
+    columns=r.index if isinstance(r,pd.Series) else None
+    return pd.DataFrame((1+rates)**-np.asarray(t,dtype=float)[:,None],index=t,columns=columns)
     
 
 def pv0(l,r):
@@ -366,23 +1054,62 @@ def pv0(l,r):
     return (discounts*l).sum()
 
 def pv(flows,r):
-    dates=flows.index
-    discounts=discount(dates,r)
-    return discounts.multiply(flows,axis='rows').sum()
-    
+    """pv of a series of cash flows indexed by time, one value per rate if r is a vector
+    a T*N matrix of rates goes through cash_flow_analytics and gives a T*N array"""
+    if np.ndim(r)>=2:
+        return cash_flow_analytics(flows,r)['pv']
+    discounts=discount(flows.index,r)
+    return pd.Series(np.asarray(flows,dtype=float)@discounts.values,index=discounts.columns)
+
+def cash_flow_analytics(flows,rates,t0=0):
+    """pv, macaulay duration and convexity of a series of cash flows indexed by time (in periods)
+    rates is the flat per period rate: a scalar, a vector of scenario rates or a T*N matrix
+    t0 broadcasts against rates and is the time the flows are valued at, flows before t0 drop out,
+    e.g. t0=np.arange(T)[:,None] values the remaining flows at every step of every scenario
+    the three come from one pass over the discounted flows, broadcast over the rates
+    return a dict of pv, duration and convexity arrays shaped like rates"""
+    times=np.asarray(flows.index,dtype=float)
+    amounts=np.asarray(flows,dtype=float)
+    rates=np.asarray(rates,dtype=float)
+    t0=np.asarray(t0,dtype=float)
+    shape=np.broadcast_shapes(rates.shape,t0.shape)
+    log_growth=np.log1p(rates)
+    pv=np.zeros(shape)
+    pv_t=np.zeros(shape)
+    pv_tt=np.zeros(shape)
+    # chunks of flows keep the flows*rates temporaries around a million cells
+    chunk=max(1,int(1e6//max(1,np.prod(shape))))
+    expand=(-1,)+(1,)*len(shape)
+    for i in range(0,len(times),chunk):
+        ttm=times[i:i+chunk].reshape(expand)-t0
+        discounted=np.where(ttm>=0,amounts[i:i+chunk].reshape(expand)*np.exp(-ttm*log_growth),0)
+        pv+=discounted.sum(axis=0)
+        pv_t+=(ttm*discounted).sum(axis=0)
+        pv_tt+=(ttm*(ttm+1)*discounted).sum(axis=0)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        duration=pv_t/pv
+        convexity=pv_tt/(pv*(1+rates)**2)
+    return {'pv':pv,'duration':duration,'convexity':convexity}
 
 def funding_ratio(assets,liabilities,r):
     return pv(assets,r)/pv(liabilities,r)
 
-def bond_cash_flows(maturity=5, principle=100, coupon_rate=0.03, coupons_per_year=12):
-    """return a series of CF generated by bond, indexed by a coupon number"""
+@functools.lru_cache(maxsize=256)
+def coupon_schedule(maturity=5, principle=100, coupon_rate=0.03, coupons_per_year=12):
+    """coupon numbers and cash flows of a bond as read-only arrays, computed once per bond spec"""
     n_coupons=round(maturity*coupons_per_year)
     coupon_amt=principle*coupon_rate/coupons_per_year
-    coupons=np.repeat(coupon_amt,n_coupons)
     coupon_times=np.arange(1,n_coupons+1)
-    cash_flows=pd.Series(data=coupon_amt,index=coupon_times)
-    cash_flows.iloc[-1]+=principle
-    return cash_flows
+    cash_flows=np.repeat(coupon_amt,n_coupons)
+    cash_flows[-1]+=principle
+    coupon_times.flags.writeable=False
+    cash_flows.flags.writeable=False
+    return coupon_times,cash_flows
+
+def bond_cash_flows(maturity=5, principle=100, coupon_rate=0.03, coupons_per_year=12):
+    """return a series of CF generated by bond, indexed by a coupon number"""
+    coupon_times,cash_flows=coupon_schedule(maturity, principle, coupon_rate, coupons_per_year)
+    return pd.Series(data=cash_flows,index=coupon_times,copy=True)
 
 def bond_price0(maturity, principle=100, coupon_rate=0.03, coupons_per_year=12, discount_rate=0.03):
     """price a bond"""
@@ -391,22 +1118,36 @@ def bond_price0(maturity, principle=100, coupon_rate=0.03, coupons_per_year=12,
 
 def bond_price(maturity, principle=100, coupon_rate=0.03, coupons_per_year=12, rates=0.03):
     """compute the price if the discount rate is not just a number"""
-    if isinstance(rates, pd.DataFrame): # generate bond prices for every single time
-        pricing_dates=rates.index
-        prices=pd.DataFrame(index=pricing_dates,columns=rates.columns)
-        for t in pricing_dates:
-            prices.loc[t]=bond_price(maturity-t/coupons_per_year,principle,coupon_rate,coupons_per_year,rates.loc[t])
-        return prices
+    if isinstance(rates, pd.DataFrame): # generate bond prices for every single time, in one broadcast
+        ttm=maturity-rates.index.values[:,None]/coupons_per_year
+        prices=flat_rate_bond_price(ttm,rates.values,principle,coupon_rate,coupons_per_year)
+        return pd.DataFrame(prices,index=rates.index,columns=rates.columns)
     else: # base case, single time period
         if maturity<=0: return principle+principle*coupon_rate/coupons_per_year
         cash_flows=bond_cash_flows(maturity, principle, coupon_rate, coupons_per_year)
         return pv(cash_flows, rates/coupons_per_year)
 
+def flat_rate_bond_price(ttm, rates, principle=100, coupon_rate=0.03, coupons_per_year=12):
+    """closed form of pv(bond_cash_flows) at flat annual rates: coupon annuity plus discounted principle
+    every argument broadcasts, so a whole ladder of bonds can be priced on T*N rates at once"""
+    y=np.asarray(rates,dtype=float)/coupons_per_year
+    n_coupons=np.round(np.asarray(ttm)*coupons_per_year)
+    coupon_amt=np.asarray(principle)*coupon_rate/coupons_per_year
+    discounts=(1+y)**-n_coupons
+    annuity=np.where(y==0,n_coupons,(1-discounts)/np.where(y==0,1,y))
+    return np.where(ttm<=0,principle+coupon_amt,coupon_amt*annuity+principle*discounts)
+
+def bond_ladder_prices(maturities, principle=100, coupon_rates=0.03, coupons_per_year=12, rates=0.03):
+    """price a ladder of B bonds on a T*N dataframe/array of annual rates (as returned by cir) in one broadcast
+    maturities, coupon_rates and coupons_per_year are scalars or length B, return a T*N*B array"""
+    rates=np.asarray(rates,dtype=float)[:,:,None]
+    coupons_per_year=np.asarray(coupons_per_year,dtype=float)
+    ttm=np.asarray(maturities,dtype=float)-np.arange(rates.shape[0])[:,None,None]/coupons_per_year
+    return flat_rate_bond_price(ttm,rates,principle,np.asarray(coupon_rates,dtype=float),coupons_per_year)
+
 def macaulay_duration(flows,discount_rate):
-    """comopute mac duration of a sequence of cf"""
-    discounted_flows=discount(flows.index,discount_rate)*flows
-    weights=discounted_flows/discounted_flows.sum()
-    return np.average(flows.index,weights=weights) ## np weighted-average function
+    """comopute mac duration of a sequence of cf, discount_rate can also be an array of rates"""
+    return cash_flow_analytics(flows,discount_rate)['duration'][()]
 
 def match_durations(cf_t,cf_s,cf_l,discount_rate):
     """return the weights w, 1-w that match target duration"""
@@ -416,39 +1157,110 @@ def match_durations(cf_t,cf_s,cf_l,discount_rate):
     return (d_l-d_t)/(d_l-d_s)
 
 import math
-def cir(n_years=10, n_scenarios=1, a=0.05, b=0.03, sigma=0.05, steps_per_year=12, r_0=None):
-    """implement CIR for int rate, a is speed to revert, b is LT mean"""
+def cir(n_years=10, n_scenarios=1, a=0.05, b=0.03, sigma=0.05, steps_per_year=12, r_0=None, exact=False,
+        output='pandas', dtype=np.float64):
+    """implement CIR for int rate, a is speed to revert, b is LT mean
+    exact=True samples the noncentral chi-square transition instead of the Euler step, no abs reflection needed
+    output='numpy' returns the (rates, prices) arrays without building dataframes, dtype=np.float32 halves their memory"""
     if r_0 is None: r_0=b
     r_0=ann_to_inst(r_0)
     dt=1/steps_per_year
     # sacle is the sigma
     num_steps=int(n_years*steps_per_year)+1
     # plus 1 because we want to initialize array of rates, contain initial rate at row 0
-    shock=np.random.normal(0,scale=np.sqrt(dt),size=(num_steps,n_scenarios))
+    if exact:
+        rates,prices=cir_exact_paths(np.random,r_0,num_steps,n_scenarios,n_years,a,b,sigma,dt)
+    else:
+        shock=np.random.normal(0,scale=np.sqrt(dt),size=(num_steps,n_scenarios))
+        rates,prices=cir_paths(shock,r_0,n_years,a,b,sigma,dt)
+    np.expm1(rates,out=rates) # inst_to_ann in place
+    rates,prices=rates.astype(dtype,copy=False),prices.astype(dtype,copy=False)
+    if output=='numpy':
+        return rates, prices
+    rates=pd.DataFrame(data=rates,index=range(num_steps))
+    prices=pd.DataFrame(data=prices,index=range(num_steps))
+    return rates, prices
+
+def cir_paths(shock,r_0,n_years,a,b,sigma,dt):
+    """run the CIR recursion over a num_steps*n_scenarios array of shocks
+    r_0 is the short rate, return the short rates and zc bond prices as numpy arrays"""
+    num_steps=shock.shape[0]
     rates=np.empty_like(shock)
     rates[0]=r_0
-    ## for price generation
-    h=math.sqrt(a**2+2*sigma**2)
-    prices=np.empty_like(shock)
-    
-    def price(ttm,r):
-        _A=((2*h*math.exp((h+a)*ttm/2))/(2*h+(h+a)*(math.exp(h*ttm)-1)))**(2*a*b/sigma**2)
-        _B=(2*(math.exp(h*ttm)-1))/(2*h+(h+a)*(math.exp(h*ttm)-1))
-        _P=_A*np.exp(-_B*r)
-        return _P
-    prices[0]=price(n_years,r_0)
     # start with 1 because we already filled 0 with r_0
     for step in range(1,num_steps):
         # d_rt is the change in rate
         r_t=rates[step-1]
         d_r_t=a*(b-r_t)*dt+sigma*np.sqrt(r_t)*shock[step]
         rates[step]=abs(r_t+d_r_t)
-        ## generating price at time t as well
-        prices[step]=price(n_years-step*dt,rates[step])
-    rates=pd.DataFrame(data=inst_to_ann(rates),index=range(num_steps))
-    prices=pd.DataFrame(data=prices,index=range(num_steps))
+    ## zc prices for every (step, scenario) in one broadcast, A and B only depend on the time to maturity
+    ttm=n_years-np.arange(num_steps)*dt
+    prices=cir_zc_price(ttm[:,None],rates,a,b,sigma)
+    return rates, prices
+
+def cir_exact_paths(rng,r_0,num_steps,n_scenarios,n_years,a,b,sigma,dt):
+    """CIR short rates drawn from the exact scaled noncentral chi-square transition, one draw per step for all scenarios
+    rng is a Generator or np.random, return the short rates and zc bond prices as numpy arrays"""
+    exp_a=math.exp(-a*dt)
+    c=sigma**2*(-math.expm1(-a*dt))/(4*a)
+    df=4*a*b/sigma**2
+    rates=np.empty((num_steps,n_scenarios))
+    rates[0]=r_0
+    for step in range(1,num_steps):
+        rates[step]=c*rng.noncentral_chisquare(df,rates[step-1]*exp_a/c)
+    ttm=n_years-np.arange(num_steps)*dt
+    prices=cir_zc_price(ttm[:,None],rates,a,b,sigma)
     return rates, prices
 
+def cir_ab(ttm,a=0.05,b=0.03,sigma=0.05):
+    """closed form CIR coefficients for an array of times to maturity, P(ttm,r)=A*exp(-B*r)"""
+    ttm=np.asarray(ttm,dtype=float)
+    h=math.sqrt(a**2+2*sigma**2)
+    exp_h_m1=np.expm1(h*ttm)
+    denom=2*h+(h+a)*exp_h_m1
+    _A=(2*h*np.exp((h+a)*ttm/2)/denom)**(2*a*b/sigma**2)
+    _B=2*exp_h_m1/denom
+    return _A,_B
+
+def cir_zc_price(ttm,r,a=0.05,b=0.03,sigma=0.05):
+    """CIR price of a zc bond paying 1, ttm and the short rate r broadcast against each other"""
+    _A,_B=cir_ab(ttm,a,b,sigma)
+    return _A*np.exp(-_B*r)
+
+def cir_bond_price(maturity, principle=100, coupon_rate=0.03, coupons_per_year=12, rates=0.03,
+                   a=0.05, b=0.03, sigma=0.05, steps_per_year=12):
+    """price a coupon bond under CIR for every (step, scenario) cell of a T*N array/dataframe of annualized rates
+    each cash flow is discounted at the CIR zc price of its remaining time, flows already paid drop out"""
+    r=ann_to_inst(np.asarray(rates,dtype=float))
+    if r.ndim<2: r=r.reshape(r.shape[0] if r.ndim else 1,-1)
+    coupon_times,cash_flows=coupon_schedule(maturity, principle, coupon_rate, coupons_per_year)
+    # time to each payment seen from each step, T*n_flows
+    ttm=coupon_times/coupons_per_year-np.arange(r.shape[0])[:,None]/steps_per_year
+    _A,_B=cir_ab(np.maximum(ttm,0),a,b,sigma)
+    _A=np.where(ttm>=0,_A,0)*cash_flows
+    prices=np.zeros_like(r)
+    for j in range(ttm.shape[1]):
+        prices+=_A[:,j:j+1]*np.exp(-_B[:,j:j+1]*r)
+    if isinstance(rates,pd.DataFrame):
+        return pd.DataFrame(prices,index=rates.index,columns=rates.columns)
+    return prices
+
+def cir_blocks(n_years=10, n_scenarios=1, a=0.05, b=0.03, sigma=0.05, steps_per_year=12, r_0=None,
+               block_size=10000, seed=None, exact=False):
+    """streaming version of cir, yields (rates, prices) numpy arrays of at most block_size scenarios
+    rates are annualized as in cir, blocks are seeded through block_rngs"""
+    if r_0 is None: r_0=b
+    r_0=ann_to_inst(r_0)
+    dt=1/steps_per_year
+    num_steps=int(n_years*steps_per_year)+1
+    for rng,size in block_rngs(n_scenarios,block_size,seed):
+        if exact:
+            rates,prices=cir_exact_paths(rng,r_0,num_steps,size,n_years,a,b,sigma,dt)
+        else:
+            shock=rng.normal(0,scale=np.sqrt(dt),size=(num_steps,size))
+            rates,prices=cir_paths(shock,r_0,n_years,a,b,sigma,dt)
+        yield np.expm1(rates,out=rates),prices # inst_to_ann in place
+
 def inst_to_ann(r):
     """convert short rate to annualized rate"""
     return np.expm1(r)
@@ -459,44 +1271,94 @@ def ann_to_inst(r):
     return np.log1p(r)
 # 1p means plus 1
 
+@functools.lru_cache(maxsize=256)
+def coupon_pay_steps(n_months,coupons_per_year):
+    """monthly steps (1 to n_months) a coupon is paid on, computed once per schedule"""
+    n_coupons=int(coupons_per_year*n_months/12)
+    pay_steps=np.round(np.arange(1,n_coupons+1)*12/coupons_per_year).astype(int)
+    pay_steps.flags.writeable=False
+    return pay_steps
+
+def total_return_array(prices,principal,coupon_rate,coupons_per_year):
+    """bond total returns from a T*... array of monthly prices, the last axis can hold a ladder of bonds
+    with its own coupon_rate and coupons_per_year each, return the (T-1)*... array of returns"""
+    prices=np.asarray(prices,dtype=float)
+    total_returns=np.divide(prices[1:],prices[:-1])
+    total_returns-=1
+    coupon_rates=np.broadcast_to(coupon_rate,prices.shape[-1:] if prices.ndim>2 else ())
+    freqs=np.broadcast_to(coupons_per_year,coupon_rates.shape)
+    for i in np.ndindex(coupon_rates.shape):
+        pay_steps=coupon_pay_steps(prices.shape[0]-1,int(freqs[i]))
+        # the coupon paid at step t adds coupon/P(t-1) to the return of step t
+        total_returns[(pay_steps-1,Ellipsis)+i]+=principal*coupon_rates[i]/freqs[i]/prices[(pay_steps-1,Ellipsis)+i]
+    return total_returns
+
 def bond_total_return(monthly_prices,principal,coupon_rate,coupons_per_year):
     """compute the bond total return based on bond prices and coupon payments"""
-    coupons=pd.DataFrame(data=0, index=monthly_prices.index,columns=monthly_prices.columns)
-    t_max=monthly_prices.index.max()
-    pay_date=np.linspace(12/coupons_per_year,t_max,int(coupons_per_year*t_max/12),dtype=int)
-    coupons.iloc[pay_date]=principal*coupon_rate/coupons_per_year
-    total_returns=(monthly_prices+coupons)/monthly_prices.shift()-1
-    return total_returns.dropna()
+    total_returns=total_return_array(monthly_prices.values,principal,coupon_rate,coupons_per_year)
+    return pd.DataFrame(total_returns,index=monthly_prices.index[1:],columns=monthly_prices.columns)
+
+def bond_ladder_total_return(prices,principal,coupon_rates,coupons_per_year,weights=None):
+    """total returns of a ladder of bonds from the T*N*B prices of bond_ladder_prices
+    return the (T-1)*N*B returns, or the (T-1)*N returns of the ladder held at constant weights"""
+    total_returns=total_return_array(prices,principal,coupon_rates,coupons_per_year)
+    return total_returns if weights is None else total_returns@np.asarray(weights,dtype=float)
 
 # define a backtest by allocation between two assets,# keyword argument, accept any argument/parameter you input
-def bt_mix(r1,r2,allocator,**kwargs):
+def bt_mix(r1,r2,allocator,output='pandas',dtype=np.float64,**kwargs):
     """r1,r2 are T*N dataframes returns, T is time step, N is # of scenarios,
-    allocation to the 1st portfolio return a T*1 dataframe
-    return a T*N dataframe for N scenarios"""
+    allocation to the 1st portfolio return a T*N dataframe, or a T*1 (or 1-D) vector / scalar
+    that is broadcast across the scenarios
+    return a T*N dataframe for N scenarios, or a T*N dtype array if output='numpy'"""
     if not r1.shape==r2.shape:
         raise ValueError('r1, r2 need to be the same shape')
     weights=allocator(r1,r2,**kwargs)
-    if not weights.shape==r1.shape:
+    if not isinstance(weights,pd.DataFrame):
+        weights=np.asarray(weights,dtype=float)
+        if weights.ndim==1:
+            weights=weights[:,None]
+        if weights.ndim>2 or any(w not in (1,n) for w,n in zip(weights.shape,r1.shape)):
+            raise ValueError('allocator weights need to broadcast to the shape of r1 and r2')
+    elif not weights.shape==r1.shape:
         raise ValueError('allocator weights and r1 and r2 need to be the same')
+    if output=='numpy':
+        weights=np.asarray(weights)
+        r1,r2=np.asarray(r1),np.asarray(r2)
+        # r2+w*(r1-r2) in a single buffer of the result dtype
+        r_mix=np.subtract(r1,r2,dtype=dtype)
+        r_mix*=weights
+        r_mix+=r2
+        return r_mix
     r_mix=weights*r1+(1-weights)*r2
     return r_mix
 
-def fixedmix_allocator(r1,r2,w1,**kwargs):
+def fixedmix_allocator(r1,r2,w1,as_vector=False,**kwargs):
     """produce a time series over T steps of allocation between PSP and GHP across N scenarios
        row is price of time step, column is scenario
-       return T*N dataframe of PSP weights"""
+       return T*N dataframe of PSP weights, or just the scalar w1 for bt_mix to broadcast if as_vector"""
+    if as_vector:
+        return np.float64(w1)
     return pd.DataFrame(data=w1,index=r1.index,columns=r1.columns)
 
 def terminal_values(rets):
-    """return the final values of a dollar at the end of return period for wach scenario"""
+    """return the final values of a dollar at the end of return period for wach scenario
+    rets can also be an iterable of T*N return blocks (see gbm_blocks), reduced one block at a time"""
+    if is_blocks(rets):
+        return pd.Series(np.concatenate([np.prod(block+1,axis=0) for block in rets]))
+    if isinstance(rets,np.ndarray):
+        return pd.Series(np.prod(rets+1,axis=0))
     return (rets+1).prod()
 
-def termianl_stats(rets,floor=0.8,cap=np.inf,name='Stats'):
-    terminal_wealth=(rets+1).prod()
+def termianl_stats(rets,floor=0.8,cap=np.inf,name='Stats',std_errors=False,method='mc',n_replicates=16,
+                   control=None,control_mean=None):
+    """terminal wealth statistics, std_errors=True adds a 'std_error' column
+    method and n_replicates describe how rets was drawn (see gbm), control and control_mean an optional
+    control variate for mean, p_breach and p_reach (e.g. terminal_values of the gbm returns and gbm_terminal_mean)"""
+    terminal_wealth=terminal_values(rets)
     breach=terminal_wealth<floor
     reach=terminal_wealth>=cap
     p_breach=breach.mean() if breach.sum()>0 else np.nan # how often does breach happen?
-    p_reach=breach.mean() if reach.sum()>0 else np.nan
+    p_reach=reach.mean() if reach.sum()>0 else np.nan
     e_short=(floor-terminal_wealth[breach]).mean() if breach.sum()>0 else np.nan # expected shortfall
     e_surplus=(cap-terminal_wealth[reach]).mean() if reach.sum()>0 else np.nan
     sum_stats=pd.DataFrame.from_dict({
@@ -507,15 +1369,127 @@ def termianl_stats(rets,floor=0.8,cap=np.inf,name='Stats'):
         "p_reach":p_reach,
         "e_surplus":e_surplus},
         orient='index',columns=[name])
+    if std_errors:
+        w=np.asarray(terminal_wealth,dtype=float)
+        est=lambda x: mc_estimate(x,method,n_replicates,control,control_mean)
+        ratio=lambda num,den: mc_ratio_estimate(num,den,method,n_replicates)
+        stats={'mean':est(w),'p_breach':est(breach),'p_reach':est(reach),
+               'e_short':ratio(np.where(breach,floor-w,0),breach),'e_surplus':ratio(np.where(reach,cap-w,0),reach)}
+        if control is not None:
+            for k in ('mean','p_breach','p_reach'):
+                if not np.isnan(sum_stats.loc[k,name]):
+                    sum_stats.loc[k,name]=stats[k]['estimate']
+        sum_stats['std_error']=pd.Series({k:v['std_error'] for k,v in stats.items()})
     return sum_stats
-        
-def glidepath_allocator(r1,r2,start_glide=1,end_glide=0):
-    """simulate a target date fund style gradual move from r1 to r2"""
+
+def mc_units(values,method='mc',n_replicates=16):
+    """collapse per-scenario values (last axis) into independent units, whose spread gives the standard error:
+    the scenarios themselves for 'mc', antithetic pair means or Sobol replicate means (see gbm_shocks)"""
+    values=np.asarray(values,dtype=float)
+    n=values.shape[-1]
+    if method=='antithetic':
+        return (values[...,:n//2]+values[...,n//2:])/2
+    if method=='sobol':
+        return values.reshape(values.shape[:-1]+(n_replicates,n//n_replicates)).mean(axis=-1)
+    return values
+
+def mc_estimate(values,method='mc',n_replicates=16,control=None,control_mean=None):
+    """Monte Carlo mean of per-scenario values with its standard error, as a Series (estimate, std_error)
+    with a control (per-scenario values with known expectation control_mean) the regression adjusted estimate is returned"""
+    y=mc_units(values,method,n_replicates)
+    if control is not None:
+        c=mc_units(control,method,n_replicates)
+        c_c=c-c.mean()
+        beta=(c_c*(y-y.mean())).sum()/(c_c**2).sum()
+        y=y-beta*(c-control_mean)
+    return pd.Series({'estimate':y.mean(),'std_error':y.std(ddof=1)/np.sqrt(len(y))})
+
+def mc_ratio_estimate(num,den,method='mc',n_replicates=16):
+    """mean(num)/mean(den) with a delta method standard error, for conditional means such as the expected shortfall"""
+    a,b=mc_units(num,method,n_replicates),mc_units(den,method,n_replicates)
+    ratio=a.mean()/b.mean() if b.mean()>0 else np.nan
+    return pd.Series({'estimate':ratio,'std_error':(a-ratio*b).std(ddof=1)/np.sqrt(len(a))/b.mean() if b.mean()>0 else np.nan})
+
+def cppi_floor_stats(backtest_result,method='mc',n_replicates=16,control=None,control_mean=None):
+    """probability that the CPPI wealth ever closes below start*floor and the mean terminal wealth, with standard errors
+    backtest_result is a single (m, floor) run_cppi result (dict or SimResult), method and n_replicates describe how risky_r was drawn"""
+    wealth=np.asarray(backtest_result['Wealth'])
+    floor_value=backtest_result['start']*backtest_result['floor']
+    violation=(wealth<floor_value).any(axis=0)
+    return pd.DataFrame({'p_violation':mc_estimate(violation,method,n_replicates,control,control_mean),
+                         'terminal wealth':mc_estimate(wealth[-1],method,n_replicates,control,control_mean)}).T
+
+def glidepath_allocator(r1,r2,start_glide=1,end_glide=0,as_vector=False):
+    """simulate a target date fund style gradual move from r1 to r2
+    as_vector returns the T*1 glide path for bt_mix to broadcast instead of a T*N dataframe"""
     n_points=r1.shape[0]
     n_col=r1.shape[1]
-    path=pd.Series(data=np.linspace(start_glide,end_glide,num=n_points))
-    paths=pd.concat([path]*n_col,axis=1)
-    paths.index=r1.index
-    paths.columns=r1.columns
-    return paths        
+    path=np.linspace(start_glide,end_glide,num=n_points)[:,None]
+    if as_vector:
+        return path
+    return pd.DataFrame(data=np.repeat(path,n_col,axis=1),index=r1.index,columns=r1.columns)
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import itertools
+import inspect
+def share_array(a):
+    """copy a into a new shared memory block, return the block and the (name, shape, dtype) a worker maps it back with"""
+    a=np.ascontiguousarray(a,dtype=float)
+    shm=shared_memory.SharedMemory(create=True,size=max(a.nbytes,1))
+    np.ndarray(a.shape,dtype=a.dtype,buffer=shm.buf)[:]=a
+    return shm,(shm.name,a.shape,a.dtype.str)
+
+sweep_state={}
+def sweep_init(r1_spec,r2_spec,allocator,as_vector):
+    """process pool initializer, map the scenario matrices from shared memory without copying them"""
+    for key,(name,shape,dtype) in (('r1',r1_spec),('r2',r2_spec)):
+        shm=shared_memory.SharedMemory(name=name)
+        sweep_state[key+' shm']=shm
+        sweep_state[key]=pd.DataFrame(np.ndarray(shape,dtype=dtype,buffer=shm.buf),copy=False)
+    sweep_state['allocator']=allocator
+    sweep_state['as_vector']=as_vector
+
+def sweep_point(params):
+    """bt_mix and termianl_stats for one point of the grid, floor and cap go to termianl_stats"""
+    kwargs=dict(params)
+    floor=kwargs.pop('floor',0.8)
+    cap=kwargs.pop('cap',np.inf)
+    if sweep_state['as_vector']:
+        kwargs['as_vector']=True
+    rets=bt_mix(sweep_state['r1'],sweep_state['r2'],sweep_state['allocator'],**kwargs)
+    stats=termianl_stats(rets,floor=floor,cap=cap)
+    return {**params,**stats.iloc[:,0].to_dict()}
+
+def sweep_bt_mix(r1,r2,allocator,grid,max_workers=None,as_vector=None):
+    """run bt_mix and termianl_stats for every point of a grid of parameters over a process pool
+    r1,r2 are T*N returns (e.g. from gbm or cir), they are put in shared memory once so workers don't get pickled copies
+    grid is a dict of lists (every combination is run) or a list of dicts, 'floor' and 'cap' go to termianl_stats
+    and everything else to the allocator, with as_vector=True so that it returns broadcastable weights
+    as_vector=None passes it only if the allocator takes an as_vector argument
+    max_workers=0 runs the grid in this process
+    return a dataframe with one row per grid point: the parameters and the terminal stats"""
+    if isinstance(grid,dict):
+        grid=[dict(zip(grid.keys(),values)) for values in itertools.product(*grid.values())]
+    if not np.shape(r1)==np.shape(r2):
+        raise ValueError('r1, r2 need to be the same shape')
+    if as_vector is None:
+        as_vector='as_vector' in inspect.signature(allocator).parameters
+    shm1,r1_spec=share_array(r1)
+    shm2,r2_spec=share_array(r2)
+    try:
+        if max_workers==0:
+            sweep_init(r1_spec,r2_spec,allocator,as_vector)
+            rows=[sweep_point(params) for params in grid]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers,initializer=sweep_init,
+                                     initargs=(r1_spec,r2_spec,allocator,as_vector)) as pool:
+                n_workers=max_workers or os.cpu_count() or 1
+                rows=list(pool.map(sweep_point,grid,chunksize=max(1,len(grid)//(4*n_workers))))
+    finally:
+        sweep_state.clear()
+        for shm in (shm1,shm2):
+            shm.close()
+            shm.unlink()
+    return pd.DataFrame(rows)
     
@@ -0,0 +1,280 @@
+"""binomial tree option pricing, the StockOption classes of the option pricing notebook
+plus a batch engine that prices a whole option chain in one call"""
+import math
+import numpy as np
+from scipy.stats import norm
+from collections import OrderedDict
+
+## store common attributes of a stock option
+class StockOption(object):
+    def __init__(self,S0,K,r=0.05,T=1,N=2,pu=0,pd=0,div=0,sigma=0,is_put=False,is_am=False):
+        self.S0=S0
+        self.K=K
+        self.r=r
+        self.T=T
+        self.N=max(1,N)
+        self.STs=[] #stock price tree
+
+        self.pu,self.pd=pu,pd
+        self.div=div
+        self.sigma=sigma
+        self.is_call=not is_put
+        self.is_european=not is_am
+
+    @property
+    def dt(self):
+        return self.T/float(self.N) # single time strp, in years
+    @property
+    def df(self):
+        return math.exp(-self.r*self.dt) # discount factor, the dividend yield only enters the growth
+    @property
+    def growth(self):
+        return math.exp((self.r-self.div)*self.dt) # risk neutral growth of the stock over one step
+
+class BinomialTreeOption(StockOption):
+    def setup_parameters(self):
+        # required calculations for the model
+        self.u=1+self.pu
+        self.d=1-self.pd
+        self.qu=(self.growth-self.d)/(self.u-self.d)
+        self.qd=1-self.qu
+    def init_stock_price_tree(self):
+        # create a 2D tree at T=0 to store returns of each step
+        self.STs=[np.array([self.S0])]
+        for i in range(self.N):
+            prev_branches=self.STs[-1]
+            st=np.concatenate((prev_branches*self.u,[prev_branches[-1]*self.d]))
+            self.STs.append(st)
+    def init_payoffs_tree(self):
+        # calculate intrinsic value in each stage, add[self.N]
+        if self.is_call:
+            return np.maximum(0,self.STs[self.N]-self.K)
+        else:
+            return np.maximum(0,self.K-self.STs[self.N])
+    # create a new function to check early excerise
+    def check_early_excerise(self,payoffs,node):
+        if self.is_call:
+            return np.maximum(payoffs,self.STs[node]-self.K)
+        else:
+            return np.maximum(payoffs,self.K-self.STs[node])
+    def traverse_tree(self,payoffs): # should include function: check_early_excerise()
+        for i in reversed(range(self.N)): # reversed: start from final stage
+            payoffs=(payoffs[:-1]*self.qu+payoffs[1:]*self.qd)*self.df # of not excerising
+            if not self.is_european:
+                payoffs=self.check_early_excerise(payoffs,i) # for excerising, American
+        return payoffs
+    def begin_tree_traversal(self):
+        payoffs=self.init_payoffs_tree()
+        return self.traverse_tree(payoffs)
+    def price(self):
+        self.setup_parameters()
+        self.init_stock_price_tree()
+        payoffs=self.begin_tree_traversal()
+        return payoffs[0]
+
+# change the u and d, the rest is the same with binomial tree model
+class BinomialCRROption(BinomialTreeOption):
+    def setup_parameters(self):
+        self.u=math.exp(self.sigma*math.sqrt(self.dt))
+        self.d=1/self.u
+        self.qu=(self.growth-self.d)/(self.u-self.d)
+        self.qd=1-self.qu
+
+class BinomialLROption(BinomialTreeOption):
+    def setup_parameters(self):
+        self.N=tree_steps(self.N,'lr')
+        d1=(math.log(self.S0/self.K)+((self.r-self.div)+(self.sigma**2)/2)*self.T)/(self.sigma*math.sqrt(self.T))
+        d2=(math.log(self.S0/self.K)+((self.r-self.div)-(self.sigma**2)/2)*self.T)/(self.sigma*math.sqrt(self.T))
+        pbar=self.pp_2_inversion(d1,self.N)
+        self.p=self.pp_2_inversion(d2,self.N)
+        self.u=self.growth*pbar/self.p
+        self.d=self.growth*(1-pbar)/(1-self.p)
+        self.qu=self.p
+        self.qd=1-self.p
+    def pp_2_inversion(self,z,n):
+        return 0.5+math.copysign(1,z)*math.sqrt(0.25-0.25*math.exp(-((z/(n+(1/3)+0.1/(n+1)))**2)*(n+(1/6))))
+
+class BinomialLRWithGreeks(BinomialLROption):
+    def new_stock_price_tree(self):
+        self.STs=[np.array([self.S0*self.u/self.d,self.S0,self.S0*self.d/self.u])]
+        for i in range(self.N):
+            prev_branches=self.STs[-1]
+            st=np.concatenate((prev_branches*self.u,[prev_branches[-1]*self.d]))
+            self.STs.append(st)
+    def price(self):
+        self.setup_parameters()
+        self.new_stock_price_tree()
+        payoffs=self.begin_tree_traversal()
+        option_value=payoffs[len(payoffs)//2]
+        payoff_up=payoffs[0]
+        payoff_down=payoffs[-1]
+        S_up=self.STs[0][0]
+        S_down=self.STs[0][-1]
+        dS_up=S_up-self.S0
+        dS_down=self.S0-S_down
+        # delta
+        ds=S_up-S_down
+        dV=payoff_up-payoff_down
+        delta=dV/ds
+        # gamma
+        gamma=((payoff_up-option_value)/dS_up-(option_value-payoff_down)/dS_down)/(((self.S0+S_up)/2)-((self.S0+S_down)/2))
+        return option_value,delta,gamma
+
+def pp_2_inversion(z,n):
+    """Peizer-Pratt inversion of BinomialLROption for arrays of z"""
+    return 0.5+np.where(z>=0,1.,-1.)*np.sqrt(0.25-0.25*np.exp(-((z/(n+(1/3)+0.1/(n+1)))**2)*(n+(1/6))))
+
+def tree_steps(N,model='crr'):
+    """number of tree steps, Leisen-Reimer trees need an odd count so an even N is rounded up to N+1"""
+    return N+1 if model=='lr' and N%2==0 else N
+
+def tree_parameters(S0,K,r,T,sigma,div,N,model='crr'):
+    """u, d, qu and the discount factor of each option of a batch, same parameters as the classes
+    N is the actual number of steps of the tree, odd for model='lr' (see tree_steps)
+    the stock grows at r-div per step but option values are discounted at r"""
+    dt=T/float(N)
+    df=np.exp(-r*dt)
+    growth=np.exp((r-div)*dt)
+    if model=='crr':
+        u=np.exp(sigma*np.sqrt(dt))
+        d=1/u
+        qu=(growth-d)/(u-d)
+    elif model=='lr':
+        d1=(np.log(S0/K)+((r-div)+(sigma**2)/2)*T)/(sigma*np.sqrt(T))
+        d2=(np.log(S0/K)+((r-div)-(sigma**2)/2)*T)/(sigma*np.sqrt(T))
+        pbar=pp_2_inversion(d1,N)
+        qu=pp_2_inversion(d2,N)
+        u=growth*pbar/qu
+        d=growth*(1-pbar)/(1-qu)
+    else:
+        raise ValueError("model should be 'crr' or 'lr'")
+    return u,d,qu,df
+
+def bsm_price(S0,K,r=0.05,T=1,sigma=0.2,div=0,is_put=False):
+    """Black-Scholes-Merton price of european options with a continuous dividend yield, the limit of the trees
+    every argument broadcasts, used to check batch_price"""
+    S0,K,r,T,sigma,div,is_put=np.broadcast_arrays(*[np.asarray(x,dtype=float) for x in (S0,K,r,T,sigma,div,is_put)])
+    d1=(np.log(S0/K)+(r-div+sigma**2/2)*T)/(sigma*np.sqrt(T))
+    d2=d1-sigma*np.sqrt(T)
+    sign=np.where(is_put>0,-1.,1.)
+    return sign*(S0*np.exp(-div*T)*norm.cdf(sign*d1)-K*np.exp(-r*T)*norm.cdf(sign*d2))
+
+def batch_price(S0,K,r=0.05,T=1,sigma=0.2,div=0,is_put=False,is_am=False,N=100,model='crr',levels=0):
+    """price a batch of options on binomial trees (model='crr' or 'lr') in one pass
+    every contract argument broadcasts to the batch shape, all trees have N steps (N+1 for an even N with model='lr')
+    the option values live in one preallocated batch*(N+1) buffer reused at every level, and only
+    the current level's stock prices are kept (divided by u going one level back) instead of the full tree
+    return the option prices shaped like the broadcast arguments, with levels>0 also the option values
+    at the first levels of the tree, a list of batch*(i+1) arrays for i=0..levels-1 (used for the greeks)"""
+    S0,K,r,T,sigma,div,is_put,is_am=np.broadcast_arrays(*[np.asarray(x,dtype=float)
+                                                          for x in (S0,K,r,T,sigma,div,is_put,is_am)])
+    shape=S0.shape
+    N=tree_steps(N,model)
+    # node-major buffers, (N+1)*batch, so that every level is a contiguous block of rows
+    S0,K,r,T,sigma,div=[x.reshape(1,-1) for x in (S0,K,r,T,sigma,div)]
+    sign=np.where(is_put.reshape(1,-1)>0,-1.,1.) # payoff is max(sign*(S-K),0)
+    am_floor=np.where(is_am.reshape(1,-1)>0,0,-np.inf) # european options never take the exercise value
+    any_am=is_am.any()
+    u,d,qu,df=tree_parameters(S0,K,r,T,sigma,div,N,model)
+    qu_df=qu*df
+    qd_df=(1-qu)*df
+    j=np.arange(N+1)[:,None]
+    # terminal stock prices S0*u^(N-j)*d^j and payoffs
+    stock=S0*np.exp((N-j)*np.log(u)+j*np.log(d))
+    values=np.maximum(sign*(stock-K),0)
+    buffer=np.empty_like(values)
+    first_levels=[]
+    for i in reversed(range(N)):
+        v=values[:i+1]
+        b=buffer[:i+1]
+        np.multiply(values[1:i+2],qd_df,out=b)
+        v*=qu_df
+        v+=b
+        s=stock[:i+1]
+        s/=u
+        if any_am:
+            np.subtract(s,K,out=b)
+            b*=sign
+            b+=am_floor
+            np.maximum(v,b,out=v)
+        if i<levels:
+            first_levels.append(v.T.copy())
+    if levels>0:
+        return values[0].reshape(shape),first_levels[::-1]
+    return values[0].reshape(shape)
+
+def batch_greeks(S0,K,r=0.05,T=1,sigma=0.2,div=0,is_put=False,is_am=False,N=100,model='crr',
+                 bump_sigma=0.01,bump_r=0.0001):
+    """price, delta, gamma, theta, vega and rho of a batch of options
+    delta, gamma and theta are read off the first two levels of the pricing tree, vega and rho are central
+    differences, the bumped contracts are stacked under the base ones so that everything is one batch_price
+    traversal on one buffer, and every bump uses the same N so their discretization errors mostly cancel
+    return a dict of arrays shaped like the broadcast arguments"""
+    S0,K,r,T,sigma,div,is_put,is_am=np.broadcast_arrays(*[np.asarray(x,dtype=float)
+                                                          for x in (S0,K,r,T,sigma,div,is_put,is_am)])
+    shape=S0.shape
+    N=tree_steps(N,model)
+    S0,K,r,T,sigma,div,is_put,is_am=[x.ravel() for x in (S0,K,r,T,sigma,div,is_put,is_am)]
+    n=S0.size
+    bumps=[(0,0),(bump_sigma,0),(-bump_sigma,0),(0,bump_r),(0,-bump_r)]
+    stack=lambda x:np.tile(x,len(bumps))
+    prices,levels=batch_price(stack(S0),stack(K),np.concatenate([r+dr for _,dr in bumps]),stack(T),
+                              np.concatenate([sigma+ds for ds,_ in bumps]),stack(div),stack(is_put),stack(is_am),
+                              N,model,levels=3)
+    prices=prices.reshape(len(bumps),n)
+    v0,v1,v2=[level[:n] for level in levels]
+    u,d,_,_=tree_parameters(S0,K,r,T,sigma,div,N,model)
+    s_up,s_down=S0*u,S0*d
+    s_uu,s_ud,s_dd=S0*u*u,S0*u*d,S0*d*d
+    dt=T/float(N)
+    delta=(v1[:,0]-v1[:,1])/(s_up-s_down)
+    gamma=((v2[:,0]-v2[:,1])/(s_uu-s_ud)-(v2[:,1]-v2[:,2])/(s_ud-s_dd))/((s_uu-s_dd)/2)
+    # the middle node two steps ahead is S0 for CRR but not for LR, take out the move in S
+    ds=s_ud-S0
+    greeks={
+        'price':v0[:,0],
+        'delta':delta,
+        'gamma':gamma,
+        'theta':(v2[:,1]-v0[:,0]-delta*ds-0.5*gamma*ds**2)/(2*dt),
+        'vega':(prices[1]-prices[2])/(2*bump_sigma),
+        'rho':(prices[3]-prices[4])/(2*bump_r)
+    }
+    return {name:value.reshape(shape) for name,value in greeks.items()}
+
+class GreeksEngine(object):
+    """batch_greeks for a book of options with results cached by contract and market state,
+    re-running the book only prices the contracts whose inputs changed
+    the cache is an LRU of at most maxsize contract and market states, the least recently used are evicted"""
+    fields=('price','delta','gamma','theta','vega','rho')
+
+    def __init__(self,N=100,model='crr',bump_sigma=0.01,bump_r=0.0001,maxsize=100000):
+        self.N=N
+        self.model=model
+        self.bump_sigma=bump_sigma
+        self.bump_r=bump_r
+        self.maxsize=maxsize
+        self.cache=OrderedDict()
+
+    def greeks(self,S0,K,r=0.05,T=1,sigma=0.2,div=0,is_put=False,is_am=False):
+        """same as batch_greeks, contracts already in the cache are skipped"""
+        inputs=np.broadcast_arrays(*[np.asarray(x,dtype=float) for x in (S0,K,r,T,sigma,div,is_put,is_am)])
+        shape=inputs[0].shape
+        rows=np.column_stack([x.ravel() for x in inputs])
+        keys=[tuple(row) for row in rows.tolist()]
+        found={key:self.cache[key] for key in keys if key in self.cache}
+        missing=sorted({key:i for i,key in enumerate(keys) if key not in found}.values())
+        if missing:
+            new=batch_greeks(*rows[missing].T,N=self.N,model=self.model,
+                             bump_sigma=self.bump_sigma,bump_r=self.bump_r)
+            for j,i in enumerate(missing):
+                found[keys[i]]=tuple(new[field][j] for field in self.fields)
+        values=np.array([found[key] for key in keys]).reshape(-1,len(self.fields))
+        for key,value in found.items():
+            self.cache[key]=value
+            self.cache.move_to_end(key)
+        while len(self.cache)>self.maxsize:
+            self.cache.popitem(last=False)
+        return {field:values[:,k].reshape(shape) for k,field in enumerate(self.fields)}
+
+    def clear(self):
+        self.cache.clear()
@@ -0,0 +1,74 @@
+"""yield to maturity, duration and convexity of the interest rate notebook for whole arrays of bonds
+coup is the annual coupon in percent of par and yields compound freq times a year, as in bond_ytm and bond_price"""
+import numpy as np
+
+def bond_cash_flows(par,T,coup,freq=2):
+    """padded bonds*periods cash flow matrix and the period numbers 1..max periods
+    bond i has round(freq*T) periods, the columns past its maturity are 0"""
+    par,T,coup,freq=np.broadcast_arrays(*(np.atleast_1d(np.asarray(x,dtype=float)) for x in (par,T,coup,freq)))
+    n_periods=np.maximum(np.round(freq*T).astype(int),1)
+    k=np.arange(1,n_periods.max()+1)
+    flows=np.where(k<=n_periods[:,None],(0.01*coup*par/freq)[:,None],0.0)
+    flows[np.arange(len(par)),n_periods-1]+=par
+    return flows,k
+
+def price_derivatives(flows,k,freq,ytm):
+    """price and its first two derivatives in the yield from the same discounted flows"""
+    x=1+ytm/freq
+    pv=flows*x[:,None]**-k
+    price=pv.sum(axis=1)
+    d1=-(pv*k).sum(axis=1)/(freq*x)
+    d2=(pv*k*(k+1)).sum(axis=1)/(freq*x)**2
+    return price,d1,d2,pv
+
+def bond_analytics(price,par,T,coup,freq=2,guess=None,tol=1e-12,max_iter=50):
+    """ytm, macaulay and modified duration (years) and convexity of every bond in one array pass
+    Halley iterations with analytic derivatives, a bond drops out of the iteration once its step is below tol
+    guess defaults to the usual yield approximation (coupon+(par-price)/T)/((par+price)/2)
+    check 'converged', a bond that fails keeps its last iterate rather than raising as newton does
+    returns a dict of arrays: ytm, macaulay_duration, modified_duration, convexity, iterations, converged"""
+    flows,k=bond_cash_flows(par,T,coup,freq)
+    price,par,T,coup,freq=np.broadcast_arrays(*(np.atleast_1d(np.asarray(x,dtype=float)) for x in (price,par,T,coup,freq)))
+    if guess is None:
+        ytm=(0.01*coup*par+(par-price)/np.maximum(T,1/freq))/((par+price)/2)
+    else:
+        ytm=np.broadcast_to(np.asarray(guess,dtype=float),price.shape).copy()
+    iterations=np.zeros(len(price),dtype=int)
+    converged=np.zeros(len(price),dtype=bool)
+    active=np.arange(len(price))
+    for iteration in range(max_iter):
+        if len(active)==0:
+            break
+        f,d1,d2,_=price_derivatives(flows[active],k,freq[active],ytm[active])
+        f-=price[active]
+        step=2*f*d1/(2*d1**2-f*d2)
+        ytm[active]-=step
+        iterations[active]+=1
+        done=np.abs(step)<tol
+        converged[active[done]]=True
+        # a bond whose step blows up keeps converged=False instead of spinning to max_iter
+        active=active[~done&np.isfinite(step)]
+    p,d1,d2,pv=price_derivatives(flows,k,freq,ytm)
+    macaulay=(pv*k).sum(axis=1)/(freq*p)
+    return {'ytm':ytm,'macaulay_duration':macaulay,'modified_duration':-d1/p,
+            'convexity':d2/p,'iterations':iterations,'converged':converged}
+
+def bond_price(par,T,ytm,coup,freq=2):
+    """price of every bond at its yield"""
+    flows,k=bond_cash_flows(par,T,coup,freq)
+    freq,ytm=np.broadcast_arrays(np.atleast_1d(np.asarray(freq,dtype=float)),np.atleast_1d(np.asarray(ytm,dtype=float)))
+    freq=np.broadcast_to(freq,(len(flows),))
+    ytm=np.broadcast_to(ytm,(len(flows),))
+    return price_derivatives(flows,k,freq,ytm)[0]
+
+def bond_ytm(price,par,T,coup,freq=2,guess=0.05):
+    """notebook signature, scalar in scalar out"""
+    return bond_analytics(price,par,T,coup,freq,guess)['ytm'][0]
+
+def bond_mod_duration(price,par,T,coup,freq):
+    """analytic -dP/dy/P instead of the notebook's +-dy bumps"""
+    return bond_analytics(price,par,T,coup,freq)['modified_duration'][0]
+
+def bond_convexity(price,par,T,coup,freq):
+    """analytic d2P/dy2/P instead of the notebook's +-dy bumps"""
+    return bond_analytics(price,par,T,coup,freq)['convexity'][0]
@@ -0,0 +1,162 @@
+"""SARIMAX order selection by AIC, the arima_grid_search of the time series notebook
+run as a batch service: candidate fits go to a process pool, optionally warm started from a fitted neighbour,
+and results are kept in an LRU cache keyed by series hash and order
+every candidate is fitted, with enforce_stationarity=False the diffuse burn-in depends on the order,
+so log likelihoods of nested orders are not comparable and no AIC bound can safely skip a candidate"""
+import os
+import itertools
+import hashlib
+import warnings
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+fit_cache=OrderedDict() # (series key, candidate, maxiter, warm_start) -> fit_order result, least recently used first
+FIT_CACHE_SIZE=50000
+
+def cache_get(key):
+    """cached fit result or None, a hit becomes the most recently used entry"""
+    result=fit_cache.get(key)
+    if result is not None:
+        fit_cache.move_to_end(key)
+    return result
+
+def cache_put(key,result):
+    """store a fit result, evicting the least recently used beyond FIT_CACHE_SIZE"""
+    fit_cache[key]=result
+    fit_cache.move_to_end(key)
+    while len(fit_cache)>FIT_CACHE_SIZE:
+        fit_cache.popitem(last=False)
+
+def series_key(series):
+    """hash of the values and index of a series, fits are cached under it"""
+    series=pd.Series(series)
+    h=hashlib.sha1(np.ascontiguousarray(series.values,dtype=float).tobytes())
+    h.update(pd.util.hash_pandas_object(series.index,index=False).values.tobytes())
+    return h.hexdigest()
+
+def order_grid(s,p=range(2),d=range(2),q=range(2),P=None,D=None,Q=None):
+    """every (order, seasonal_order) pair, the seasonal ranges default to the non seasonal ones"""
+    P=p if P is None else P
+    D=d if D is None else D
+    Q=q if Q is None else Q
+    return [(order,seasonal+(s,)) for order in itertools.product(p,d,q)
+            for seasonal in itertools.product(P,D,Q)]
+
+def n_params(order,seasonal_order):
+    """number of estimated parameters, ar and ma lags plus the innovation variance"""
+    return order[0]+order[2]+seasonal_order[0]+seasonal_order[2]+1
+
+def diff_group(order,seasonal_order):
+    """candidates with the same differencing are fitted on the same differenced data"""
+    return (order[1],seasonal_order[1],seasonal_order[3])
+
+def lag_distance(a,b):
+    """distance between the lag structures of two candidates, used to pick a warm start"""
+    return abs(a[0][0]-b[0][0])+abs(a[0][2]-b[0][2])+abs(a[1][0]-b[1][0])+abs(a[1][2]-b[1][2])
+
+def fit_order(series,order,seasonal_order,start_params=None,maxiter=200):
+    """fit one SARIMAX candidate, failures are returned in 'error' instead of being raised
+    start_params is a dict of parameter name to value from a neighbouring fit, the fit starts there and is
+    only redone from the default start if it raises or does not converge"""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            model=SARIMAX(series,order=order,seasonal_order=seasonal_order,
+                          enforce_stationarity=False,enforce_invertibility=False)
+            model_result=None
+            if start_params:
+                start=np.array([start_params.get(name,x) for name,x in zip(model.param_names,model.start_params)])
+                try:
+                    model_result=model.fit(start_params=start,maxiter=maxiter,disp=False)
+                    if not model_result.mle_retvals.get('converged',True):
+                        model_result=None
+                except Exception:
+                    model_result=None # fall back to the cold fit
+            if model_result is None:
+                model_result=model.fit(maxiter=maxiter,disp=False)
+        return {'aic':model_result.aic,'bic':model_result.bic,'llf':model_result.llf,
+                'params':dict(zip(model.param_names,model_result.params)),
+                'converged':bool(model_result.mle_retvals.get('converged',True)),'error':None}
+    except Exception as ex:
+        return {'aic':np.nan,'bic':np.nan,'llf':np.nan,'params':None,'converged':False,
+                'error':'{}: {}'.format(type(ex).__name__,ex)}
+
+def fit_task(task):
+    """pool entry point, task is (name, series, order, seasonal_order, start_params, maxiter)"""
+    name,series,order,seasonal_order,start_params,maxiter=task
+    return fit_order(series,order,seasonal_order,start_params,maxiter)
+
+def search_orders(series,s=12,grid=None,warm_start=False,maxiter=200,max_workers=None):
+    """pick the lowest AIC SARIMAX order for every series in a dict or DataFrame (one column per series)
+    the candidates of all series are fitted together on a process pool, max_workers=0 fits in process
+    warm_start=True fits in waves by number of parameters and starts each candidate from the closest smaller
+    fitted lag structure, a warm fit that fails or does not converge is redone cold, without warm starts
+    the whole grid is submitted at once
+    warm starts can land in a different local optimum than the default start, so they are opt-in
+    returns a dict with 'best', one row per series, and 'fits', one row per candidate"""
+    if isinstance(series,pd.Series):
+        series={series.name if series.name is not None else 0:series}
+    elif isinstance(series,pd.DataFrame):
+        series={name:series[name].dropna() for name in series.columns}
+    grid=order_grid(s) if grid is None else grid
+    keys={name:series_key(y) for name,y in series.items()}
+    fits={name:{} for name in series}
+    if warm_start:
+        by_size=sorted(grid,key=lambda c: n_params(*c))
+        waves=[list(w) for _,w in itertools.groupby(by_size,key=lambda c: n_params(*c))]
+    else:
+        waves=[list(grid)]
+
+    def neighbour_params(name,cand):
+        done=[(c,r) for c,r in fits[name].items() if r['params'] is not None and diff_group(*c)==diff_group(*cand)]
+        if not warm_start or not done:
+            return None
+        return min(done,key=lambda cr: (lag_distance(cr[0],cand),n_params(*cr[0])))[1]['params']
+
+    executor=ProcessPoolExecutor(max_workers=max_workers) if max_workers!=0 else None
+    try:
+        for wave in waves:
+            tasks=[]
+            for name,y in series.items():
+                for cand in wave:
+                    result=cache_get((keys[name],cand,maxiter,warm_start))
+                    if result is not None:
+                        fits[name][cand]=result
+                        continue
+                    tasks.append((name,y,cand[0],cand[1],neighbour_params(name,cand),maxiter))
+            chunksize=max(1,len(tasks)//(4*(max_workers or os.cpu_count() or 1)))
+            results=executor.map(fit_task,tasks,chunksize=chunksize) if executor is not None else map(fit_task,tasks)
+            for task,result in zip(tasks,results):
+                name,cand=task[0],(task[2],task[3])
+                cache_put((keys[name],cand,maxiter,warm_start),result)
+                fits[name][cand]=result
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    rows=[]
+    for name in series:
+        for cand in grid:
+            result=fits[name].get(cand)
+            rows.append({'series':name,'order':cand[0],'seasonal_order':cand[1],
+                         'aic':np.nan if result is None else result['aic'],
+                         'bic':np.nan if result is None else result['bic'],
+                         'converged':False if result is None else result['converged'],
+                         'error':None if result is None else result['error']})
+    fits_df=pd.DataFrame(rows)
+    for name,group in fits_df.groupby('series',sort=False):
+        for error in group['error'].dropna():
+            warnings.warn('SARIMAX fit failed for {}: {}'.format(name,error))
+    ok=fits_df.dropna(subset=['aic'])
+    best_df=ok.loc[ok.groupby('series',sort=False)['aic'].idxmin()].set_index('series')
+    best_df=best_df[['order','seasonal_order','aic','bic','converged']].reindex(list(series))
+    counts=fits_df.groupby('series',sort=False).agg(fitted=('aic','count'),failed=('error','count'))
+    return {'best':best_df.join(counts),'fits':fits_df}
+
+def arima_grid_search(dataframe,s,max_workers=0):
+    """lowest_aic, order and seasonal_order of the notebook's grid search, fitted on dataframe"""
+    best=search_orders(pd.Series(dataframe),s,max_workers=max_workers)['best'].iloc[0]
+    return best['aic'],best['order'],best['seasonal_order']
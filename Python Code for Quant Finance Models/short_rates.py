@@ -0,0 +1,76 @@
+"""short rate simulators of the interest rate notebook, every scenario in one array pass
+rates are returned as (N+1)*n_paths arrays, one column per path, with the step index range(N+1) as in the notebook
+each call draws from its own Generator (rng), an int or None is passed to np.random.default_rng"""
+import math
+import numpy as np
+from scipy.signal import lfilter
+
+def ar1_paths(x0,phi,scale,shock):
+    """x[0]=x0, x[n]=phi*x[n-1]+scale*shock[n], run as a compiled linear filter down the rows of shock"""
+    e=scale*shock
+    e[0]=x0
+    return lfilter([1.0],[1.0,-phi],e,axis=0)
+
+def vasicek(r0,K,theta,sigma,T=1,N=10,n_paths=1,rng=None,exact=True):
+    """dr=K*(theta-r)*dt+sigma*dW
+    exact=True samples the Gaussian transition, so a coarse grid has no discretization error
+    exact=False is the notebook's Euler step"""
+    rng=np.random.default_rng(rng)
+    dt=T/float(N)
+    if exact:
+        phi=math.exp(-K*dt)
+        scale=sigma*math.sqrt(-math.expm1(-2*K*dt)/(2*K)) if K!=0 else sigma*math.sqrt(dt)
+    else:
+        phi=1-K*dt
+        scale=sigma*math.sqrt(dt)
+    shock=rng.standard_normal(size=(N+1,n_paths))
+    return range(N+1),theta+ar1_paths(r0-theta,phi,scale,shock)
+
+def CIR(r0,K,theta,sigma,T=1,N=10,n_paths=1,rng=None,exact=True):
+    """dr=K*(theta-r)*dt+sigma*sqrt(r)*dW
+    exact=True samples the scaled noncentral chi-square transition, rates stay non negative on any grid
+    exact=False is an Euler step with full truncation, max(r,0) inside the drift and diffusion"""
+    rng=np.random.default_rng(rng)
+    dt=T/float(N)
+    rates=np.empty((N+1,n_paths))
+    rates[0]=r0
+    if exact:
+        exp_k=math.exp(-K*dt)
+        c=sigma**2*(-math.expm1(-K*dt))/(4*K)
+        df=4*K*theta/sigma**2
+        for i in range(N):
+            rates[i+1]=c*rng.noncentral_chisquare(df,rates[i]*exp_k/c)
+    else:
+        shock=rng.standard_normal(size=(N,n_paths))*math.sqrt(dt)
+        for i in range(N):
+            r_pos=np.maximum(rates[i],0)
+            rates[i+1]=rates[i]+K*(theta-r_pos)*dt+sigma*np.sqrt(r_pos)*shock[i]
+    return range(N+1),rates
+
+def rendleman_bartter(r0,theta,sigma,T=1,N=10,n_paths=1,rng=None,exact=True):
+    """dr=theta*r*dt+sigma*r*dW, a GBM
+    exact=True samples the lognormal transition with a cumulative sum of log increments, no step loop
+    exact=False is the notebook's Euler step"""
+    rng=np.random.default_rng(rng)
+    dt=T/float(N)
+    shock=rng.standard_normal(size=(N+1,n_paths))
+    shock[0]=0
+    if exact:
+        log_r=(theta-0.5*sigma**2)*dt+sigma*math.sqrt(dt)*shock
+        log_r[0]=math.log(r0)
+        return range(N+1),np.exp(np.cumsum(log_r,axis=0))
+    growth=1+theta*dt+sigma*math.sqrt(dt)*shock
+    growth[0]=r0
+    return range(N+1),np.cumprod(growth,axis=0)
+
+def brennan_schwartz(r0,K,theta,sigma,T=1,N=10,n_paths=1,rng=None):
+    """dr=K*(theta-r)*dt+sigma*r*dW
+    there is no closed form transition, this is the notebook's Euler step run across all paths at once"""
+    rng=np.random.default_rng(rng)
+    dt=T/float(N)
+    shock=rng.standard_normal(size=(N,n_paths))*(sigma*math.sqrt(dt))
+    rates=np.empty((N+1,n_paths))
+    rates[0]=r0
+    for i in range(N):
+        rates[i+1]=rates[i]+K*(theta-rates[i])*dt+rates[i]*shock[i]
+    return range(N+1),rates
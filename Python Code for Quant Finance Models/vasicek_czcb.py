@@ -0,0 +1,172 @@
+"""callable zero coupon bond values under the Vasicek model with an implicit finite difference scheme,
+the VasicekCZCB class of the interest rate notebook rebuilt around a factorized tridiagonal operator"""
+import math
+import numpy as np
+import scipy.stats as st
+from scipy.linalg import lapack, solve_banded
+
+class VasicekCZCB:
+
+    def __init__(self):
+        self.norminv=st.distributions.norm.ppf
+        self.norm=st.distributions.norm.cdf
+
+    def vasicek_czcb_values(self,r0,R,ratio,T,sigma,kappa,theta,
+                            M,prob=1e-6,max_policy_iter=10,
+                            grid_struct_const=0.25,rs=None,call_schedule=None):
+        """values of callable zero coupon bonds on the short rate grid r
+        R and ratio can be arrays, one bond per element, all bonds share the grid and a single factorization
+        call_schedule is an optional boolean array of shape (M,) or (M, n_bonds), True where the call is live at step i=1..M
+        returns r and the values, (N,) for scalar R and ratio, (N, n_bonds) otherwise"""
+        (r_min,dr,N,dtau)=\
+            self.vasicek_params(r0,M,sigma,kappa,theta,
+                                T,prob,grid_struct_const,rs)
+        r=np.r_[0:N]*dr+r_min
+        R,ratio=np.broadcast_arrays(np.asarray(R,dtype=float),np.asarray(ratio,dtype=float))
+        is_scalar=R.ndim==0
+        R,ratio=R.ravel(),ratio.ravel()
+        n_bonds=R.size
+        if call_schedule is None:
+            call_schedule=np.ones((M,n_bonds),dtype=bool)
+        else:
+            call_schedule=np.asarray(call_schedule,dtype=bool)
+            call_schedule=np.broadcast_to(call_schedule.reshape(M,-1),(M,n_bonds))
+
+        # the operator does not depend on the step, assemble and factorize it once
+        (subdiagonal,diagonal,superdiagonal)=\
+            self.vasicek_diagonals(sigma,kappa,theta,r_min,dr,N,dtau)
+        factors=self.factorize(subdiagonal,diagonal,superdiagonal)
+
+        v_mplus1=np.ones((N,n_bonds))
+        for i in range(1,M+1):
+            K=self.exercise_call_price(R,ratio,i*dtau)
+            v_mplus1=self.step(factors,subdiagonal,v_mplus1,K,call_schedule[i-1],max_policy_iter)
+        return r,(v_mplus1[:,0] if is_scalar else v_mplus1)
+
+    def vasicek_params(self,r0,M,sigma,kappa,theta,T,
+                      prob,grid_struct_const=0.25,rs=None):
+        if rs is not None:
+            (r_min,r_max)=(rs[0],rs[-1])
+        else:
+            (r_min,r_max)=self.vasicek_limits(
+                r0,sigma,kappa,theta,T,prob)
+
+        dt=T/float(M)
+        N=self.calculate_N(grid_struct_const,dt,sigma,r_max,r_min)
+        dr=(r_max-r_min)/(N-1)
+
+        return (r_min,dr,N,dt)
+
+    def calculate_N(self,max_structure_const,dt,sigma,r_max,r_min):
+        """smallest N with dt*sigma^2/((r_max-r_min)/N)^2 > max_structure_const"""
+        N=max(1,math.floor((r_max-r_min)*math.sqrt(max_structure_const/(dt*sigma**2)))+1)
+        # guard the floor against rounding at the boundary
+        while dt*(sigma**2)/(((r_max-r_min)/float(N))**2)<=max_structure_const:
+            N+=1
+        while N>1 and dt*(sigma**2)/(((r_max-r_min)/float(N-1))**2)>max_structure_const:
+            N-=1
+        return N
+
+    def vasicek_limits(self,r0,sigma,kappa,theta,T,prob=1e-6):
+        er=theta+(r0-theta)*math.exp(-kappa*T)
+        variance=(sigma**2)*T if kappa==0 else \
+                    (sigma**2)/(2*kappa)*(1-math.exp(-2*kappa*T))
+        stdev=math.sqrt(variance)
+        r_min=self.norminv(prob,er,stdev)
+        r_max=self.norminv(1-prob,er,stdev)
+        return (r_min,r_max)
+
+    def vasicek_diagonals(self,sigma,kappa,theta,r_min,
+                          dr,N,dtau):
+        rn=np.r_[0:N]*dr+r_min
+        subdiagonals=kappa*(theta-rn)*dtau/(2*dr)-\
+                        0.5*(sigma**2)*dtau/(dr**2)
+        diagonals=1+rn*dtau+sigma**2*dtau/(dr**2)
+        superdiagonals=-kappa*(theta-rn)*dtau/(2*dr)-\
+                        0.5*(sigma**2)*dtau/(dr**2)
+
+        # Implement boundary conditions.
+        if N>0:
+            v_subd0=subdiagonals[0]
+            superdiagonals[0]=superdiagonals[0]-subdiagonals[0]
+            diagonals[0]+=2*v_subd0
+            subdiagonals[0]=0
+
+        if N>1:
+            v_superd_last=superdiagonals[-1]
+            superdiagonals[-1]=superdiagonals[-1]-subdiagonals[-1]
+            diagonals[-1]+=2*v_superd_last
+            superdiagonals[-1]=0
+
+        return (subdiagonals,diagonals,superdiagonals)
+
+    def factorize(self,subdiagonal,diagonal,superdiagonal):
+        """LU factors of the tridiagonal operator with the grid order reversed
+        the exercise region of a call sits at the low rate end, reversing puts the held nodes first
+        so the factors of the held sub-system are the leading part of the full factors
+        that only holds without row interchanges, 'pivoted' flags the banded fallback"""
+        N=len(diagonal)
+        dl,d,du,du2,ipiv,info=lapack.dgttrf(superdiagonal[:-1][::-1].copy(),diagonal[::-1].copy(),subdiagonal[1:][::-1].copy())
+        if info!=0:
+            raise np.linalg.LinAlgError('singular finite difference operator')
+        return {'dl':dl,'d':d,'du':du,'du2':du2,'ipiv':ipiv,
+                'pivoted':bool(np.any(ipiv!=np.arange(1,N+1))),
+                'ab':np.vstack([np.r_[0,superdiagonal[:-1]],diagonal,np.r_[subdiagonal[1:],0]])}
+
+    def solve_held(self,factors,m,b):
+        """solve the system restricted to the last m grid nodes, b holds one right hand side per column"""
+        N=len(factors['d'])
+        if m==1:
+            return b/factors['ab'][1,-1]
+        if m==N or not factors['pivoted']:
+            f=factors
+            x,info=lapack.dgttrs(f['dl'][:m-1],f['d'][:m],f['du'][:m-1],f['du2'][:m-2],f['ipiv'][:m],b[::-1])
+            if info!=0:
+                raise np.linalg.LinAlgError('tridiagonal solve failed, dgttrs info={}'.format(info))
+            return x[::-1]
+        return solve_banded((1,1),factors['ab'][:,N-m:],b)
+
+    def solve_policy(self,factors,subdiagonal,v_old,K,is_eex):
+        """solve one step with the called nodes pinned at K
+        a called block [0, k) at the low rate end reuses the factors, any other pattern goes through a banded solve"""
+        N=len(v_old)
+        k=N if is_eex.all() else np.argmin(is_eex)
+        v=np.empty(N)
+        v[is_eex]=K
+        if k==N:
+            return v
+        if not is_eex[k:].any():
+            b=v_old[k:].copy()
+            b[0]-=subdiagonal[k]*K
+            v[k:]=self.solve_held(factors,N-k,b[:,None])[:,0]
+            return v
+        called=np.flatnonzero(is_eex)
+        ab=factors['ab'].copy()
+        ab[0,called[called<N-1]+1]=0
+        ab[1,called]=1
+        ab[2,called[called>0]-1]=0
+        return solve_banded((1,1),ab,np.where(is_eex,K,v_old))
+
+    def step(self,factors,subdiagonal,v_old,K,is_callable,max_policy_iter=10):
+        """one implicit step for every bond with a single multi column solve,
+        then policy iteration on the bonds that get called, nodes called once stay called for the step"""
+        N=len(v_old)
+        v_new=self.solve_held(factors,N,v_old)
+        for j in np.flatnonzero(is_callable&np.any(v_new>K,axis=0)):
+            is_eex=np.zeros(N,dtype=bool)
+            v=v_new[:,j]
+            for iterations in range(max_policy_iter+1):
+                is_new=self.check_exercise(v,K[j])&~is_eex
+                if not is_new.any():
+                    break
+                is_eex|=is_new
+                v=self.solve_policy(factors,subdiagonal,v_old[:,j],K[j],is_eex)
+            v_new[:,j]=v
+        return v_new
+
+    def check_exercise(self,V,eex):
+        return V>eex
+
+    def exercise_call_price(self,R,ratio,tau):
+        K=ratio*np.exp(-R*tau)
+        return K
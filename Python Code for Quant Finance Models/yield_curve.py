@@ -0,0 +1,165 @@
+"""zero curve bootstrapping of the interest rate notebook, continuously compounded zero rates
+BootstrapYieldCurve keeps the notebook interface but re-solves only the maturities a quote change affects
+and caches log discount factors on a dense grid for array lookups of zero, forward and discount values,
+bootstrap_curves solves many curve dates at once"""
+import math
+import numpy as np
+import pandas as pd
+
+def coupon_times(T,freq):
+    """coupon dates of a bond with maturity T paying freq coupons a year, the last one is T"""
+    n=max(int(round(T*freq)),1)
+    return np.arange(1,n+1)/float(freq)
+
+def interp_log_discount(t,maturities,log_dfs):
+    """log discount factors at times t (all <= maturities[-1]) for every curve in the rows of log_dfs
+    linear in log discount between pillars (flat forwards), starting from log_df=0 at t=0"""
+    knots=np.r_[0.0,maturities]
+    idx=np.clip(np.searchsorted(knots,t,side='left'),1,len(knots)-1)
+    w=(t-knots[idx-1])/(knots[idx]-knots[idx-1])
+    log_dfs=np.hstack([np.zeros((log_dfs.shape[0],1)),log_dfs])
+    return log_dfs[:,idx-1]+w*(log_dfs[:,idx]-log_dfs[:,idx-1])
+
+def bootstrap_pillars(maturities,pars,coups,freqs,prices,zero_rates,start=0,tol=1e-12,max_iter=50):
+    """solve the zero rates of pillars start, start+1, ... in place, for every curve date in the rows of prices
+    pillar j only depends on pillars before it, coupon dates between pillar j-1 and j are flat forward
+    interpolated and the pillar is found by a Newton iteration on its log discount factor
+    with coupons on earlier pillars (the notebook case) the first iterate is already exact"""
+    log_dfs=-zero_rates*maturities
+    for j in range(start,len(maturities)):
+        T,par,coup,freq=maturities[j],pars[j],coups[j],freqs[j]
+        price=prices[:,j]
+        if coup==0:
+            log_dfs[:,j]=np.log(price/par)
+            zero_rates[:,j]=-log_dfs[:,j]/T
+            continue
+        per_coupon=coup/float(freq)
+        t=coupon_times(T,freq)[:-1]
+        T_prev=maturities[j-1] if j>0 else 0.0
+        known,mid=t[t<=T_prev],t[t>T_prev]
+        value=price-per_coupon*np.exp(interp_log_discount(known,maturities[:j],log_dfs[:,:j])).sum(axis=1) \
+            if len(known) else price.astype(float)
+        y=np.log(value/(par+per_coupon))
+        if len(mid):
+            a=log_dfs[:,j-1:j] if j>0 else np.zeros((len(price),1))
+            w=(mid-T_prev)/(T-T_prev)
+            for _ in range(max_iter):
+                mid_dfs=per_coupon*np.exp(a+w*(y[:,None]-a))
+                f=mid_dfs.sum(axis=1)+(par+per_coupon)*np.exp(y)-value
+                step=f/((mid_dfs*w).sum(axis=1)+(par+per_coupon)*np.exp(y))
+                y=y-step
+                if np.all(np.abs(step)<tol):
+                    break
+        log_dfs[:,j]=y
+        zero_rates[:,j]=-y/T
+    return zero_rates
+
+def bootstrap_curves(maturities,prices,coups=0,pars=100,freqs=2):
+    """zero rates of many curve dates in one pass, prices is dates*maturities (a DataFrame keeps its labels)
+    coups (annual coupon per par), pars and freqs are scalars or one value per maturity"""
+    is_frame=isinstance(prices,pd.DataFrame)
+    values=np.atleast_2d(np.asarray(prices,dtype=float))
+    maturities=np.asarray(maturities,dtype=float)
+    order=np.argsort(maturities)
+    n=len(maturities)
+    pars,coups,freqs=(np.broadcast_to(np.asarray(x),(n,))[order] for x in (pars,coups,freqs))
+    zero_rates=np.empty_like(values)
+    zero_rates[:,order]=bootstrap_pillars(maturities[order],pars,coups,freqs,values[:,order],np.zeros_like(values))
+    if is_frame:
+        return pd.DataFrame(zero_rates,index=prices.index,columns=prices.columns)
+    return zero_rates
+
+class BootstrapYieldCurve(object):
+    def __init__(self,points_per_year=360):
+        self.instruments=dict()
+        self.points_per_year=points_per_year
+        self.maturities=np.empty(0)
+        self.zero_rates=np.empty(0)
+        self.grid_log_df=np.zeros(1)
+        self.dirty_from=math.inf
+    def add_instrument(self,par,T,coup,price,compounding_freq=2):
+        self.instruments[T]=(par,coup,price,compounding_freq)
+        self.dirty_from=min(self.dirty_from,T)
+    def update_price(self,T,price):
+        """new quote for the instrument maturing at T, only T and later maturities are re-solved"""
+        (par,coup,_,freq)=self.instruments[T]
+        self.add_instrument(par,T,coup,price,freq)
+    def remove_instrument(self,T):
+        del self.instruments[T]
+        self.dirty_from=min(self.dirty_from,T)
+    def get_maturities(self):
+        return sorted(self.instruments.keys()) # return a list of available maturities in ascending order
+    def get_zero_rates(self):
+        self.bootstrap()
+        return list(self.zero_rates)
+    def bootstrap(self):
+        """re-solve the pillars from the first changed maturity on, then refresh the grid past the pillar before it"""
+        if self.dirty_from==math.inf:
+            return
+        maturities=np.array(self.get_maturities(),dtype=float)
+        start=int(np.searchsorted(maturities,self.dirty_from))
+        zero_rates=np.empty((1,len(maturities)))
+        zero_rates[0,:start]=self.zero_rates[:start] # maturities before the change are untouched
+        pars,coups,prices,freqs=(np.array(x,dtype=float) for x in zip(*[self.instruments[T] for T in maturities]))
+        bootstrap_pillars(maturities,pars,coups,freqs,prices[None,:],zero_rates,start)
+        self.maturities,self.zero_rates=maturities,zero_rates[0]
+        self.dirty_from=math.inf
+        self.update_grid(maturities[start-1] if start>0 else 0.0)
+    def update_grid(self,t_from):
+        """log discount factors on the grid k/points_per_year up to the last maturity, recomputed from t_from on"""
+        n_grid=int(math.ceil(self.maturities[-1]*self.points_per_year))+1
+        k0=min(int(t_from*self.points_per_year),len(self.grid_log_df),n_grid)
+        grid_log_df=np.empty(n_grid)
+        grid_log_df[:k0]=self.grid_log_df[:k0]
+        t=np.arange(k0,n_grid)/float(self.points_per_year)
+        grid_log_df[k0:]=self.extrapolate(t,interp_log_discount(np.minimum(t,self.maturities[-1]),self.maturities,
+                                                                (-self.zero_rates*self.maturities)[None,:])[0])
+        self.grid_log_df=grid_log_df
+    def extrapolate(self,t,log_df):
+        """flat zero rate past the last maturity"""
+        return np.where(t>self.maturities[-1],-self.zero_rates[-1]*t,log_df)
+    def log_discount(self,t):
+        """log discount factors for an array of tenors, linear between grid points"""
+        self.bootstrap()
+        t=np.asarray(t,dtype=float)
+        x=t*self.points_per_year
+        k=np.clip(np.floor(x).astype(int),0,len(self.grid_log_df)-2)
+        w=x-k
+        log_df=self.grid_log_df[k]+w*(self.grid_log_df[k+1]-self.grid_log_df[k]) if len(self.grid_log_df)>1 else np.zeros_like(t)
+        return self.extrapolate(t,log_df)
+    def discount(self,t):
+        return np.exp(self.log_discount(t))
+    def zero(self,t):
+        """continuously compounded zero rates, the first pillar's rate at t=0"""
+        t=np.asarray(t,dtype=float)
+        log_df=self.log_discount(t)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            return np.where(t>0,-log_df/t,self.zero_rates[0])
+    def forward(self,t1,t2):
+        """continuously compounded forward rates between tenors t1 < t2"""
+        t1,t2=np.asarray(t1,dtype=float),np.asarray(t2,dtype=float)
+        return (self.log_discount(t1)-self.log_discount(t2))/(t2-t1)
+    def get_forward_rates(self):
+        """forwards between consecutive maturities, as ForwardRates.get_forward_rates"""
+        self.bootstrap()
+        return list(np.diff(self.zero_rates*self.maturities)/np.diff(self.maturities))
+
+class ForwardRates(object):
+    def __init__(self):
+        self.forward_rates=[]
+        self.spot_rates=dict()
+    def add_spot_rate(self,T,spot_rate):
+        self.spot_rates[T]=spot_rate
+        self.forward_rates=None
+    def get_forward_rates(self):
+        """forwards between consecutive periods in one array pass, cached until a spot rate is added"""
+        if self.forward_rates is None:
+            periods=np.array(sorted(self.spot_rates.keys()),dtype=float)
+            rt=np.array([self.spot_rates[T] for T in periods])*periods
+            self.forward_rates=list(np.diff(rt)/np.diff(periods))
+        return self.forward_rates
+    def calculate_forward_rate(self,T1,T2):
+        R1=self.spot_rates[T1]
+        R2=self.spot_rates[T2]
+        forward_rate=(R2*T2-R1*T1)/(T2-T1)
+        return forward_rate